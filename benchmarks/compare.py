@@ -0,0 +1,51 @@
+"""Compare two benchmark result files.
+
+Prints the candidate/baseline ratio of wall time, peak RSS and round-trips
+for every (table, scale, stage) present in both, and exits non-zero when any
+stage got slower than `--threshold`.
+
+Usage
+-----
+    python benchmarks/compare.py <baseline>.json <candidate>.json
+"""
+import sys
+import json
+import argparse
+
+def _load(path):
+    with open(path) as fh:
+        report = json.load(fh)
+    return report, {(r['table'], r['scale'], r['stage']): r
+                    for r in report['results']}
+
+def _ratio(new, old):
+    return new / old if old else float('nan')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=1.10,
+                        help="Time ratio above which a stage is a regression.")
+    args = parser.parse_args(argv)
+
+    old_report, old = _load(args.baseline)
+    new_report, new = _load(args.candidate)
+    print(f"baseline  {old_report['commit']}  {old_report['timestamp']}")
+    print(f"candidate {new_report['commit']}  {new_report['timestamp']}")
+
+    regressions = []
+    for key in sorted(set(old) & set(new)):
+        table, scale, stage = key
+        time_ratio = _ratio(new[key]['seconds'], old[key]['seconds'])
+        rss_ratio = _ratio(new[key]['peak_rss_mb'], old[key]['peak_rss_mb'])
+        trips = f"{old[key]['round_trips']}->{new[key]['round_trips']}"
+        flag = ' REGRESSION' if time_ratio > args.threshold else ''
+        print(f"{table:<18} {scale:>10,} {stage:<36} time x{time_ratio:5.2f}  "
+              f"rss x{rss_ratio:5.2f}  trips {trips}{flag}")
+        if flag:
+            regressions.append(key)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
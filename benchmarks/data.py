@@ -0,0 +1,88 @@
+"""Deterministic synthetic data for the benchmark suite.
+
+Every frame is generated from `(scale, seed)`, so each benchmark process can
+rebuild exactly the same baseline and import data without sharing memory.
+"""
+import numpy as np
+import pandas as pd
+
+days_per_asset = 2500          # ~10 years of trading days
+tidemarks_per_asset = 10
+quarters_per_tidemark = 40     # ~10 years of quarterly history
+
+# Index order of `functions.get_unique_cols` for each table.
+unique_cols = {
+    'price_history': ['asset_id', 'date'],
+    'tidemark_history': ['asset_id', 'date', 'tidemark_id'],
+}
+
+def asset_count(scale: int, table: str) -> int:
+    rows_per_asset = days_per_asset if table == 'price_history' \
+        else tidemarks_per_asset * quarters_per_tidemark
+    return max(1, scale // rows_per_asset)
+
+def dimensions(scale: int):
+    """Asset and tidemark dimension rows large enough for either table."""
+    n_assets = max(asset_count(scale, t) for t in ('price_history',
+                                                    'tidemark_history'))
+    assets = pd.DataFrame({'asset': [f"A{i:06d}" for i in range(n_assets)]})
+    tidemarks = pd.DataFrame({'tidemark': [f"TM{i:02d}"
+                                           for i in range(tidemarks_per_asset)]})
+    return assets, tidemarks
+
+def baseline(table: str, scale: int, seed: int = 0) -> pd.DataFrame:
+    """Existing rows of `table`, indexed by its unique columns.
+
+    Asset and tidemark ids are 1-based, matching the serial ids assigned when
+    `dimensions` are loaded into an empty database.
+    """
+    rng = np.random.default_rng(seed)
+    n_assets = asset_count(scale, table)
+    if table == 'price_history':
+        dates = pd.bdate_range('2000-01-03', periods=max(1, scale // n_assets))
+        asset_ids = np.repeat(np.arange(1, n_assets + 1), len(dates))
+        frame = pd.DataFrame({
+            'asset_id': asset_ids,
+            'date': np.tile(dates.values, n_assets),
+            'price': np.round(rng.lognormal(3, 1, len(asset_ids)), 4),
+        })
+        return frame.set_index(['asset_id', 'date'])
+
+    per_asset = max(1, scale // n_assets)
+    quarters = max(1, per_asset // tidemarks_per_asset)
+    dates = pd.date_range('2000-03-31', periods=quarters, freq='Q')
+    keys = pd.MultiIndex.from_product(
+        [np.arange(1, n_assets + 1), np.arange(1, tidemarks_per_asset + 1),
+         dates], names=['asset_id', 'tidemark_id', 'date'])
+    frame = pd.DataFrame({'value': np.round(rng.normal(0, 1, len(keys)), 6)},
+                         index=keys)
+    return frame.reorder_levels(unique_cols[table]).sort_index()
+
+def import_frame(table: str, scale: int, mix=(0.1, 0.1, 0.8),
+                 seed: int = 0) -> pd.DataFrame:
+    """An import dataframe of `scale` rows against `baseline(table, scale)`.
+
+    `mix` is the fraction of (inserted, updated, unchanged) rows.
+    """
+    inserts, updates, _ = mix
+    rng = np.random.default_rng(seed + 1)
+    base = baseline(table, scale, seed)
+    value_col = base.columns[0]
+
+    n_inserts = int(len(base) * inserts)
+    n_updates = int(len(base) * updates)
+    keep = rng.permutation(len(base))[:len(base) - n_inserts]
+    existing = base.iloc[np.sort(keep)].copy()
+    existing.iloc[:n_updates, 0] = existing.iloc[:n_updates, 0] * 1.01 + 0.01
+
+    # New rows continue each key's series past its last date.
+    new = base.iloc[-n_inserts:].copy() if n_inserts else base.iloc[:0].copy()
+    levels = list(new.index.names)
+    new = new.reset_index()
+    # Shift by whole days past the baseline's span so no new key collides
+    # with an existing one (a year offset maps Feb 29 onto Feb 28).
+    dates = base.index.get_level_values('date')
+    new['date'] = new['date'] + (dates.max() - dates.min() + pd.Timedelta(days=1))
+    new = new.set_index(levels)
+    new[value_col] = np.round(rng.normal(10, 1, len(new)), 4)
+    return pd.concat([existing, new]).sort_index()
@@ -0,0 +1,85 @@
+"""Before/after query plans of the history-table layout migration.
+
+Starts a throwaway local Postgres (or uses `--url`), loads the synthetic
+baseline at `--scale`, runs `EXPLAIN ANALYZE` on the standard reads of each
+table, migrates the tables to date partitions with `layout.migrate`,
+`create_indexes` and `analyze`, and prints the plans again side by side.
+Finally it upserts an import frame into each migrated table with
+`copy_upsert` and checks the reported insert count.
+
+Usage
+-----
+    python benchmarks/layout.py --scale 1000000 --interval year
+"""
+import os
+import sys
+import argparse
+import tempfile
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_dir))
+
+import postgres
+from run import _reset_schema
+
+def check_upsert(db_table, table: str, scale: int, seed: int):
+    """`copy_upsert` into the migrated table and check its counts."""
+    from lodestar.database import get_engine, loader
+    import data
+    count = f"SELECT count(*) FROM financial.{table}"
+    with get_engine().connect() as connection:
+        before = connection.exec_driver_sql(count).scalar()
+    inserted, updated = loader.copy_upsert(
+        data.import_frame(table, scale, seed=seed), db_table)
+    with get_engine().connect() as connection:
+        after = connection.exec_driver_sql(count).scalar()
+    print(f"copy_upsert into partitioned {table}: {inserted} inserted, "
+          f"{updated} updated")
+    if after - before != inserted:
+        raise RuntimeError(f"{table} grew by {after - before} rows but "
+                           f"copy_upsert reported {inserted} inserts.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', type=int, default=1000000)
+    parser.add_argument('--tables', default='price_history,tidemark_history')
+    parser.add_argument('--interval', default='year', choices=['year', 'month'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help="Use this database instead of starting "
+                        "one. Its `financial` schema is DROPPED; requires --reset.")
+    parser.add_argument('--reset', action='store_true')
+    args = parser.parse_args(argv)
+    if args.url and not args.reset:
+        parser.error("--url drops and recreates the `financial` schema; "
+                     "pass --reset to confirm.")
+
+    os.environ.setdefault('TTG_DATA_DIRECTORY', tempfile.mkdtemp())
+    cluster = None if args.url else postgres.LocalPostgres().start()
+    url = args.url or cluster.url
+    os.environ['TTG_DATABASE_URL'] = url
+    try:
+        _reset_schema(url)
+        import stages
+        stages.load_database(args.scale, args.seed)
+
+        import pandas as pd
+        from lodestar.database import layout
+        pd.set_option('display.width', 250)
+        pd.set_option('display.max_colwidth', 120)
+        for table in args.tables.split(','):
+            db_table = stages.model(table)
+            layout.analyze(db_table)
+            before = layout.explain(db_table)
+            layout.migrate(db_table, interval=args.interval)
+            layout.create_indexes(db_table)
+            layout.analyze(db_table, include_parent=True)
+            after = layout.explain(db_table)
+            print(f"\n{table}")
+            print(layout.report(before, after).to_string())
+            check_upsert(db_table, table, args.scale, args.seed)
+    finally:
+        if cluster is not None:
+            cluster.stop()
+
+if __name__ == '__main__':
+    main()
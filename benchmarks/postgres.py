@@ -0,0 +1,79 @@
+"""Throwaway local Postgres cluster for the benchmark suite.
+
+The cluster lives in a temporary directory, listens only on a unix socket in
+that directory and is removed on `stop()`.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+
+database = 'lodestar_bench'
+schema_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+def _bin_dir():
+    """Directory holding `initdb`/`pg_ctl`, from PATH or `pg_config`."""
+    initdb = shutil.which('initdb')
+    if initdb:
+        return os.path.dirname(initdb)
+    pg_config = shutil.which('pg_config')
+    if pg_config:
+        return subprocess.check_output([pg_config, '--bindir'], text=True).strip()
+    raise RuntimeError("Postgres server binaries (initdb, pg_ctl) not found; "
+                       "install Postgres or pass --url.")
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class LocalPostgres:
+    def __init__(self):
+        self.bin_dir = _bin_dir()
+        self.directory = tempfile.mkdtemp(prefix='lodestar-bench-')
+        self.data_dir = os.path.join(self.directory, 'data')
+        self.port = _free_port()
+
+    @property
+    def url(self):
+        return (f"postgresql+psycopg2://postgres@/{database}"
+                f"?host={self.directory}&port={self.port}")
+
+    def _run(self, *args):
+        subprocess.run([os.path.join(self.bin_dir, args[0]), *args[1:]],
+                       check=True, stdout=subprocess.DEVNULL)
+
+    def start(self):
+        self._run('initdb', '-D', self.data_dir, '-U', 'postgres',
+                  '--auth=trust', '--no-sync')
+        options = (f"-p {self.port} -k {self.directory} -c listen_addresses='' "
+                   f"-c fsync=off -c synchronous_commit=off")
+        self._run('pg_ctl', '-D', self.data_dir, '-o', options, '-w',
+                  '-l', os.path.join(self.directory, 'postgres.log'), 'start')
+        self._run('createdb', '-h', self.directory, '-p', str(self.port),
+                  '-U', 'postgres', database)
+        return self
+
+    def stop(self):
+        try:
+            self._run('pg_ctl', '-D', self.data_dir, '-m', 'fast', '-w', 'stop')
+        finally:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def create_schema(url):
+    """Create the `financial` tables in an empty database."""
+    from sqlalchemy import create_engine
+    engine = create_engine(url)
+    with open(schema_file) as fh:
+        statements = [s for s in fh.read().split(';') if s.strip()]
+    with engine.begin() as connection:
+        for statement in statements:
+            connection.exec_driver_sql(statement)
+    engine.dispose()
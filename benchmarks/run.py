@@ -0,0 +1,125 @@
+"""Benchmark suite for the read, diff and write hot paths.
+
+Starts a throwaway local Postgres (or uses `--url`), loads synthetic
+`assets`, `price_history` and `tidemark_history` data at each scale and runs
+every stage in a fresh process, recording wall time, peak RSS and database
+round-trips. Results are written as JSON to `benchmarks/results/` and can be
+compared between commits with `compare.py`.
+
+Usage
+-----
+    python benchmarks/run.py --scales 10000,100000 --mix 0.1,0.1,0.8
+    python benchmarks/compare.py results/<before>.json results/<after>.json
+"""
+import os
+import sys
+import json
+import argparse
+import datetime as dt
+import platform
+import subprocess
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+sys.path.insert(0, repo_dir)
+
+import postgres
+import stages
+
+def _in_process(function, *args):
+    """Run `function(*args)` in a fresh interpreter and return its result."""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(function, *args).result()
+
+def _commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=repo_dir, text=True).strip()
+        dirty = subprocess.run(['git', 'diff', '--quiet', 'HEAD', '--', 'lodestar'],
+                               cwd=repo_dir).returncode != 0
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def _reset_schema(url):
+    from sqlalchemy import create_engine
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP SCHEMA IF EXISTS financial CASCADE")
+    engine.dispose()
+    postgres.create_schema(url)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scales', default='10000,100000,1000000,10000000',
+                        help="Comma separated row counts per history table.")
+    parser.add_argument('--tables', default='price_history,tidemark_history')
+    parser.add_argument('--stages', default=','.join(stages.stages),
+                        help="Comma separated stage names.")
+    parser.add_argument('--mix', default='0.1,0.1,0.8',
+                        help="Fractions of inserted, updated and unchanged rows.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help="Use this database instead of starting "
+                        "one. Its `financial` schema is DROPPED; requires --reset.")
+    parser.add_argument('--reset', action='store_true',
+                        help="Allow dropping the `financial` schema at --url.")
+    parser.add_argument('--output', default=os.path.join(bench_dir, 'results'))
+    args = parser.parse_args(argv)
+    if args.url and not args.reset:
+        parser.error("--url drops and recreates the `financial` schema; "
+                     "pass --reset to confirm.")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    scales = [int(s) for s in args.scales.split(',')]
+    tables = args.tables.split(',')
+    stage_names = args.stages.split(',')
+    mix = tuple(float(m) for m in args.mix.split(','))
+
+    os.environ.setdefault('TTG_DATA_DIRECTORY', tempfile.mkdtemp())
+    cluster = None if args.url else postgres.LocalPostgres().start()
+    url = args.url or cluster.url
+    os.environ['TTG_DATABASE_URL'] = url
+
+    results = []
+    try:
+        for scale in scales:
+            _reset_schema(url)
+            _in_process(stages.load_database, scale, args.seed)
+            for table in tables:
+                for stage in stage_names:
+                    result = _in_process(stages.run_stage, stage, table, scale,
+                                         mix, args.seed)
+                    results.append(result)
+                    print(f"{table:<18} {scale:>10,} {stage:<36} "
+                          f"{result['seconds']:>9.3f}s "
+                          f"{result['peak_rss_mb']:>9.1f}MB "
+                          f"{result['round_trips']:>8} trips", flush=True)
+    finally:
+        if cluster is not None:
+            cluster.stop()
+
+    commit = _commit()
+    timestamp = dt.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    report = {
+        'commit': commit,
+        'timestamp': timestamp,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': results,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{timestamp}-{commit[:12]}.json")
+    with open(path, 'w') as fh:
+        json.dump(report, fh, indent=1)
+    print(f"Results written to {path}")
+    return path
+
+if __name__ == '__main__':
+    main()
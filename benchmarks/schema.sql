@@ -0,0 +1,54 @@
+-- Synthetic copy of the `financial` tables reflected by lodestar.database.models.
+CREATE SCHEMA IF NOT EXISTS financial;
+
+CREATE TABLE financial.assets (
+    id serial PRIMARY KEY,
+    asset text NOT NULL UNIQUE,
+    last_modified timestamp NOT NULL DEFAULT now()
+);
+
+CREATE TABLE financial.tidemark_types (
+    id serial PRIMARY KEY,
+    type text NOT NULL UNIQUE
+);
+
+CREATE TABLE financial.tidemarks (
+    id serial PRIMARY KEY,
+    tidemark text NOT NULL UNIQUE,
+    type_id integer REFERENCES financial.tidemark_types (id)
+);
+
+CREATE TABLE financial.tidemark_terms (
+    tidemark_id integer NOT NULL REFERENCES financial.tidemarks (id),
+    term_id integer NOT NULL REFERENCES financial.tidemarks (id),
+    PRIMARY KEY (tidemark_id, term_id)
+);
+
+CREATE TABLE financial.price_history (
+    id serial PRIMARY KEY,
+    asset_id integer NOT NULL REFERENCES financial.assets (id),
+    date date NOT NULL,
+    price numeric NOT NULL,
+    last_modified timestamp NOT NULL DEFAULT now(),
+    UNIQUE (asset_id, date)
+);
+
+CREATE TABLE financial.tidemark_history (
+    id serial PRIMARY KEY,
+    asset_id integer NOT NULL REFERENCES financial.assets (id),
+    tidemark_id integer NOT NULL REFERENCES financial.tidemarks (id),
+    date date NOT NULL,
+    value numeric,
+    last_modified timestamp NOT NULL DEFAULT now(),
+    UNIQUE (asset_id, tidemark_id, date)
+);
+
+CREATE TABLE financial.tidemark_history_daily (
+    id serial PRIMARY KEY,
+    asset_id integer NOT NULL REFERENCES financial.assets (id),
+    tidemark_id integer NOT NULL REFERENCES financial.tidemarks (id),
+    date date NOT NULL,
+    value numeric,
+    last_modified timestamp NOT NULL DEFAULT now(),
+    UNIQUE (asset_id, tidemark_id, date)
+);
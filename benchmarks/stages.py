@@ -0,0 +1,191 @@
+"""Benchmark stages for the read, diff and write hot paths.
+
+Each stage runs in its own process (see `run.py`). A stage is a `setup`
+that prepares untimed state and a `run` that is timed; database round-trips
+are counted over `run` only. `peak_rss_mb` is the peak RSS reached during
+`run` above the RSS left by `setup`: on Linux the process high-water mark is
+reset after setup (`/proc/self/clear_refs`); elsewhere the process peak is
+used and `peak_reset` is false, so setup can dominate it.
+"""
+import sys
+import time
+import resource
+import psycopg2.extensions
+from sqlalchemy import event
+import data
+
+round_trips = 0
+
+def _count(n=1):
+    global round_trips
+    round_trips += n
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """psycopg2 cursor counting statements, COPYs and server-side fetches."""
+    def execute(self, query, vars=None):
+        _count()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        _count(len(vars_list))
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, *args, **kwargs):
+        _count()
+        return super().copy_expert(sql, file, *args, **kwargs)
+
+    def fetchmany(self, *args, **kwargs):
+        if self.name:
+            _count()
+        return super().fetchmany(*args, **kwargs)
+
+def _instrument():
+    from lodestar.database import get_engine
+    event.listen(get_engine(), 'connect',
+                 lambda dbapi_connection, record: setattr(
+                     dbapi_connection, 'cursor_factory', CountingCursor))
+
+def _status_mb(field: str):
+    """`VmRSS`/`VmHWM` from `/proc/self/status` in MiB, or None."""
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def _peak_mb() -> float:
+    peak = _status_mb('VmHWM')
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+def _rss_mb() -> float:
+    rss = _status_mb('VmRSS')
+    return _peak_mb() if rss is None else rss
+
+def _reset_peak() -> bool:
+    """Reset the process peak RSS to the current RSS (Linux only)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+    except OSError:
+        return False
+    return _status_mb('VmHWM') is not None
+
+def model(table: str):
+    from lodestar.database import models
+    return getattr(models.Base.classes, table)
+
+def load_database(scale: int, seed: int = 0):
+    """Load the dimension tables and both history baselines."""
+    from lodestar.database import loader
+    assets, tidemarks = data.dimensions(scale)
+    loader.copy_upsert(assets, model('assets'))
+    loader.copy_upsert(tidemarks, model('tidemarks'))
+    for table in ('price_history', 'tidemark_history'):
+        loader.copy_upsert(data.baseline(table, scale, seed), model(table))
+
+def reset_table(table: str, scale: int, seed: int = 0):
+    """Restore `table` to its baseline after a write stage."""
+    from lodestar.database import get_engine, loader
+    with get_engine().begin() as connection:
+        connection.exec_driver_sql(
+            f"TRUNCATE financial.{table} RESTART IDENTITY")
+    loader.copy_upsert(data.baseline(table, scale, seed), model(table))
+
+## STAGES
+def _setup_none(table, scale, mix, seed):
+    return {'db_table': model(table)}
+
+def _setup_records(table, scale, mix, seed):
+    from lodestar.database.functions import all_query
+    state = _setup_none(table, scale, mix, seed)
+    state['records'] = all_query(state['db_table'])
+    return state
+
+def _setup_compare(table, scale, mix, seed):
+    state = _setup_records(table, scale, mix, seed)
+    state['import_df'] = data.import_frame(table, scale, mix, seed)
+    return state
+
+def _setup_write(table, scale, mix, seed):
+    reset_table(table, scale, seed)
+    return _setup_compare(table, scale, mix, seed)
+
+def _setup_copy(table, scale, mix, seed):
+    reset_table(table, scale, seed)
+    state = _setup_none(table, scale, mix, seed)
+    state['import_df'] = data.import_frame(table, scale, mix, seed)
+    return state
+
+def _run_all_query(state):
+    from lodestar.database.functions import all_query
+    return len(all_query(state['db_table']))
+
+def _run_collection_to_dataframe(state):
+    from lodestar.database.functions import collection_to_dataframe
+    return len(collection_to_dataframe(state['records'], state['db_table']))
+
+def _run_all_frame(state):
+    from lodestar.database.functions import all_frame
+    return len(all_frame(state['db_table']))
+
+def _run_compare(state):
+    from lodestar.database.functions import compare_to_db
+    insert_objects, update_objects = compare_to_db(
+        state['import_df'], state['records'], state['db_table'])
+    return len(insert_objects) + len(update_objects)
+
+def _run_bulk_update(state):
+    from lodestar.database.functions import update_database_object
+    update_database_object(state['import_df'], state['records'],
+                           state['db_table'])
+    return len(state['import_df'])
+
+def _run_copy_update(state):
+    from lodestar.database.functions import update_database_object
+    update_database_object(state['import_df'], None, state['db_table'],
+                           method='copy')
+    return len(state['import_df'])
+
+stages = {
+    'read.all_query': (_setup_none, _run_all_query),
+    'read.collection_to_dataframe': (_setup_records, _run_collection_to_dataframe),
+    'read.all_frame': (_setup_none, _run_all_frame),
+    'diff.compare_to_db': (_setup_compare, _run_compare),
+    'write.update_database_object.bulk': (_setup_write, _run_bulk_update),
+    'write.update_database_object.copy': (_setup_copy, _run_copy_update),
+}
+
+def run_stage(stage: str, table: str, scale: int, mix, seed: int = 0) -> dict:
+    """Run one stage and return its measurements."""
+    global round_trips
+    _instrument()
+    setup, run = stages[stage]
+    state = setup(table, scale, mix, seed)
+
+    rss_before = _rss_mb()
+    peak_reset = _reset_peak()
+    round_trips = 0
+    start = time.perf_counter()
+    rows = run(state)
+    seconds = time.perf_counter() - start
+
+    return {
+        'stage': stage,
+        'table': table,
+        'scale': scale,
+        'mix': list(mix),
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'round_trips': round_trips,
+        'rss_before_mb': round(rss_before, 1),
+        'peak_rss_mb': round(max(_peak_mb() - rss_before, 0), 1),
+        'peak_reset': peak_reset,
+    }
@@ -1,8 +1,13 @@
 """Module handles all connections to the postgresql database.
 
 Included in this module are the `functions` and `models` submodules.
-Connection is based on presence of 'wokring ip address` (`WIP`) environment 
-variable. If it is missing, we will invoke the proxy.
+Connection is based on presence of 'wokring ip address` (`WIP`) environment
+variable. If it is missing, we will invoke the proxy. Setting
+`TTG_DATABASE_URL` (e.g. to a local Postgres) bypasses the proxy entirely.
+
+The `url`, `engine` and `metadata` attributes are created on first access
+rather than at import, so importing the package does not touch the proxy or
+the database.
 
 Submodules
 ----------
@@ -15,12 +20,22 @@ import warnings
 from sqlalchemy import exc as sa_exc
 import os
 import subprocess
+import threading
 from urllib import parse
 from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.schema import MetaData
 
 home_dir = os.environ['HOME']
 psql_root_dir = os.path.join(home_dir,'.postgresql','lodestar')
+schema = 'financial'
+database_url = os.environ.get('TTG_DATABASE_URL')
+
+# Connection pool per process. Concurrent workers are bounded by
+# `pool_size + max_overflow` connections.
+pool_size = int(os.environ.get('TTG_POOL_SIZE', 5))
+max_overflow = int(os.environ.get('TTG_MAX_OVERFLOW', 5))
+pool_timeout = int(os.environ.get('TTG_POOL_TIMEOUT', 30))
 
 connect_args = {
     'sslmode': 'verify-ca',
@@ -33,7 +48,7 @@ connect_args = {
 def formatting_proxy(home_directory):
     """Format url for connection proxy."""
     # print("Formatting proxy")
-    proxy_str = os.path.join(home_directory,"cloud_sql_proxy") 
+    proxy_str = os.path.join(home_directory,"cloud_sql_proxy")
     proxy_dir = os.path.join(home_directory,"cloudsql")
     instances = "lodestar:us-central1:tidesgroup"
     username = os.environ['TTG_USERNAME'] or input("Username: ")
@@ -50,9 +65,84 @@ def formatting_proxy(home_directory):
     )
     return url
 
-url = formatting_proxy(home_dir)
-engine = create_engine(url, connect_args=connect_args)
-metadata = MetaData(bind=engine, schema='financial')
+_lock = threading.RLock()
+_url = None
+_engine = None
+_metadata = None
+_inherited_pools = []
+
+def get_url():
+    """Return the connection url, formatting it on first call."""
+    global _url
+    with _lock:
+        if _url is None:
+            _url = make_url(database_url) if database_url \
+                   else formatting_proxy(home_dir)
+        return _url
+
+def get_engine():
+    """Return the shared engine, creating it on first call.
+
+    Creating the engine does not open a connection; the first connection is
+    made when a query is executed.
+    """
+    global _engine
+    with _lock:
+        if _engine is None:
+            _engine = create_engine(
+                get_url(), connect_args={} if database_url else connect_args,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_timeout=pool_timeout,
+                pool_pre_ping=True)
+        return _engine
+
+def dispose_engine(close: bool = True):
+    """Drop pooled connections.
+
+    In a worker process after a fork pass `close=False`: the pool is replaced
+    without closing the inherited connections, which are still in use by the
+    parent. The old pool stays referenced so garbage collection does not
+    close them either (`Engine.dispose(close=False)` in SQLAlchemy 1.4.33+).
+    """
+    with _lock:
+        if _engine is None:
+            return
+        if close:
+            _engine.dispose()
+        else:
+            _inherited_pools.append(_engine.pool)
+            _engine.pool = _engine.pool.recreate()
+
+def get_metadata():
+    """Return the `financial` schema MetaData bound to the shared engine."""
+    global _metadata
+    with _lock:
+        if _metadata is None:
+            _metadata = MetaData(bind=get_engine(), schema=schema)
+        return _metadata
+
+def set_metadata(metadata):
+    """Replace the shared MetaData (used when loading the schema cache)."""
+    global _metadata
+    with _lock:
+        metadata.bind = get_engine()
+        _metadata = metadata
+        return _metadata
+
+_lazy_attributes = {
+    'url': get_url,
+    'engine': get_engine,
+    'metadata': get_metadata,
+}
+
+def __getattr__(name):
+    """Resolve `url`, `engine` and `metadata` lazily (PEP 562)."""
+    try:
+        return _lazy_attributes[name]()
+    except KeyError:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}") from None
 
 if __name__=='__main__':
-    print(url)
+    print(get_url())
@@ -0,0 +1,122 @@
+"""Asyncio variants of the dataframe query helpers.
+
+Built on SQLAlchemy's asyncio extension with the `asyncpg` driver
+(`pip install tidemarks[async]`), so many per-asset queries can be in flight
+at once over a bounded connection pool. Queries are written with the same
+`greater`/`less`/`equals` criterion builders and return the same dataframes
+as `functions.filter_frame`.
+
+Model classes are still reflected synchronously on first use (see
+`models.prepare`). asyncpg connections belong to the event loop that opened
+them, so each running loop gets its own engine and pool; one `asyncio.run`
+never reuses connections from an earlier, closed loop.
+
+Methods
+-------
+filter_frame(table, criterion)->pandas.DataFrame, all_frame(table)->pandas.DataFrame
+    Awaitable versions of `functions.filter_frame` and `functions.all_frame`.
+
+gather_frames(table, criteria)->dict
+    Run one `filter_frame` per key of `criteria` concurrently.
+
+asset_frames(table, asset_ids, criterion)->dict
+    `gather_frames` with one asset id filter per asset.
+
+Example
+-------
+>>> frames = asyncio.run(asset_frames(PriceHistory, asset_ids,
+...                                   [greater(PriceHistory, 'date', start)]))
+"""
+import ssl
+import asyncio
+import weakref
+import threading
+import pandas as pd
+from sqlalchemy.ext.asyncio import create_async_engine
+from . import (get_url, database_url, connect_args, pool_size, max_overflow,
+               pool_timeout)
+from .functions import equals, select_table, rows_to_dataframe
+
+_lock = threading.RLock()
+# `id(loop) -> (weakref to loop, engine)`; entries of closed loops are
+# dropped on the next lookup (their connections cannot be closed any more).
+_async_engines = {}
+
+def _ssl_context() -> ssl.SSLContext:
+    """SSL context equivalent to the psycopg2 `verify-ca` settings."""
+    context = ssl.create_default_context(cafile=connect_args['sslrootcert'])
+    context.check_hostname = False
+    context.load_cert_chain(connect_args['sslcert'], connect_args['sslkey'])
+    return context
+
+def get_async_engine():
+    """Return the running event loop's asyncio engine, creating it on first
+    call in that loop."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        for key, (loop_ref, _) in list(_async_engines.items()):
+            if loop_ref() is None or loop_ref().is_closed():
+                del _async_engines[key]
+        engine = _async_engines.get(id(loop), (None, None))[1]
+        if engine is None:
+            url = get_url().set(drivername='postgresql+asyncpg')
+            # The proxy is a unix socket and needs no SSL.
+            if database_url or (url.host or '').startswith('/'):
+                args = {}
+            else:
+                args = {'ssl': _ssl_context(),
+                        'timeout': connect_args['connect_timeout']}
+            engine = create_async_engine(url, connect_args=args,
+                                         pool_size=pool_size,
+                                         max_overflow=max_overflow,
+                                         pool_timeout=pool_timeout,
+                                         pool_pre_ping=True)
+            _async_engines[id(loop)] = (weakref.ref(loop), engine)
+        return engine
+
+async def dispose():
+    """Close the running loop's asyncio engine and its pooled connections."""
+    with _lock:
+        _, engine = _async_engines.pop(id(asyncio.get_running_loop()),
+                                       (None, None))
+    if engine is not None:
+        await engine.dispose()
+
+async def filter_frame(db_table, criterion, drop_last_modified=True)->pd.DataFrame:
+    """`functions.filter_frame` over the asyncio engine."""
+    async with get_async_engine().connect() as connection:
+        result = await connection.execute(select_table(db_table, criterion))
+        columns = list(result.keys())
+        rows = result.fetchall()
+    return rows_to_dataframe(rows, columns, db_table,
+                             drop_last_modified=drop_last_modified)
+
+async def all_frame(db_table, drop_last_modified=True)->pd.DataFrame:
+    """`functions.all_frame` over the asyncio engine."""
+    return await filter_frame(db_table, [], drop_last_modified=drop_last_modified)
+
+async def gather_frames(db_table, criteria: dict, limit: int = None,
+                        drop_last_modified=True) -> dict:
+    """Run `filter_frame(db_table, criterion)` for every item of `criteria`.
+
+    At most `limit` queries (default: the pool's `pool_size + max_overflow`)
+    are in flight at once. Returns the dataframes under the same keys.
+    """
+    semaphore = asyncio.Semaphore(limit or pool_size + max_overflow)
+
+    async def fetch(key, criterion):
+        async with semaphore:
+            return key, await filter_frame(db_table, criterion,
+                                           drop_last_modified=drop_last_modified)
+
+    results = await asyncio.gather(*[fetch(key, criterion)
+                                     for key, criterion in criteria.items()])
+    return dict(results)
+
+async def asset_frames(db_table, asset_ids, criterion=(), limit: int = None,
+                       drop_last_modified=True) -> dict:
+    """Fetch `db_table` rows matching `criterion` for each asset concurrently."""
+    criteria = {asset_id: [equals(db_table, 'asset_id', asset_id), *criterion]
+                for asset_id in asset_ids}
+    return await gather_frames(db_table, criteria, limit=limit,
+                               drop_last_modified=drop_last_modified)
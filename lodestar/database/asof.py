@@ -0,0 +1,193 @@
+"""Point-in-time ("as of") alignment of prices and tidemarks.
+
+`asof_panel` joins every `price_history` row to the latest known value of
+each requested tidemark on or before that row's date, for all assets at
+once. The history is read with two queries (prices, tidemarks) plus one
+`DISTINCT ON` query seeding the values already known at `start`, and the
+alignment is a single sorted `merge_asof` by `(asset_id, tidemark_id)` over
+every price row and tidemark pair.
+
+Methods
+-------
+asof_panel(asset_ids=None, tidemark_ids=None, start=None, end=None)->pandas.DataFrame
+    Prices with one as-of column per tidemark, indexed by `(asset_id, date)`.
+
+asof_join(left, right, tolerance=None)->pandas.DataFrame
+    The same alignment for dataframes already in memory.
+"""
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from . import models
+from . import metrics
+from . import maps
+from .functions import filter_frame, rows_to_dataframe
+
+def _tolerance(tolerance):
+    """`pd.Timedelta` from a timedelta, a pandas offset string or days."""
+    if tolerance is None or isinstance(tolerance, pd.Timedelta):
+        return tolerance
+    if isinstance(tolerance, (int, float)):
+        return pd.Timedelta(days=tolerance)
+    return pd.Timedelta(tolerance)
+
+def _criterion(db_table, asset_ids=None, tidemark_ids=None, start=None, end=None):
+    criterion = []
+    if asset_ids is not None:
+        criterion.append(db_table.asset_id.in_([int(i) for i in asset_ids]))
+    if tidemark_ids is not None:
+        criterion.append(db_table.tidemark_id.in_([int(i) for i in tidemark_ids]))
+    if start is not None:
+        criterion.append(db_table.date >= start)
+    if end is not None:
+        criterion.append(db_table.date <= end)
+    return criterion
+
+def seed_statement(db_table, before, asset_ids=None, tidemark_ids=None):
+    """Latest row per `(asset_id, tidemark_id)` dated before `before`."""
+    table = db_table.__table__
+    statement = select(table).distinct(table.c.asset_id, table.c.tidemark_id) \
+                             .where(table.c.date < before) \
+                             .order_by(table.c.asset_id, table.c.tidemark_id,
+                                       table.c.date.desc())
+    if asset_ids is not None:
+        statement = statement.where(table.c.asset_id.in_([int(i) for i in asset_ids]))
+    if tidemark_ids is not None:
+        statement = statement.where(
+            table.c.tidemark_id.in_([int(i) for i in tidemark_ids]))
+    return statement
+
+def tidemark_frame(db_table, asset_ids=None, tidemark_ids=None, start=None,
+                   end=None, tolerance=None, float32=False,
+                   cached: bool = True) -> pd.DataFrame:
+    """Tidemark rows needed to align dates in `[start, end]`.
+
+    Rows before `start` are only read back as far as `tolerance` allows;
+    without a tolerance the latest earlier row per asset and tidemark is
+    fetched instead. `cached` is passed to `filter_frame`.
+    """
+    tolerance = _tolerance(tolerance)
+    lower = None
+    if start is not None and tolerance is not None:
+        lower = pd.Timestamp(start) - tolerance
+    elif start is not None:
+        lower = start
+    history = filter_frame(db_table,
+                           _criterion(db_table, asset_ids, tidemark_ids,
+                                      lower, end),
+                           float32=float32, cached=cached)
+    if start is not None and tolerance is None:
+        result = models.session.execute(
+            seed_statement(db_table, start, asset_ids, tidemark_ids))
+        seed = rows_to_dataframe(result.fetchall(), list(result.keys()),
+                                 db_table, float32=float32)
+        history = pd.concat([seed, history]).sort_index()
+    return history
+
+def asof_join(left: pd.DataFrame, right: pd.DataFrame, tolerance=None,
+              value_col: str = 'value', names: bool = False,
+              tidemark_ids=None) -> pd.DataFrame:
+    """Add one column per tidemark in `right` to `left`, as of `left`'s dates.
+
+    Parameters
+    ==========
+    left: pandas.DataFrame
+        Rows to align, with `asset_id` and `date` as columns or index levels.
+    right: pandas.DataFrame
+        Tidemark history with `asset_id`, `tidemark_id`, `date` and
+        `value_col`, as columns or index levels.
+    tolerance:
+        Maximum age of a tidemark value (`pd.Timedelta`, offset string or
+        days); older values are left as NaN.
+    names: bool
+        Name the new columns by tidemark name rather than id.
+    tidemark_ids: list
+        The tidemark columns to return, in this order; a tidemark without
+        rows in `right` gets an all-NaN column. By default one column per
+        tidemark in `right`.
+
+    Returns
+    =======
+    pandas.DataFrame
+        `left` indexed by `(asset_id, date)` with the tidemark columns added.
+    """
+    tolerance = _tolerance(tolerance)
+    left = left.reset_index() if isinstance(left.index, pd.MultiIndex) \
+                              or left.index.name else left
+    right = right.reset_index() if isinstance(right.index, pd.MultiIndex) \
+                                or right.index.name else right
+    # merge_asof needs the `on` key sorted across all groups.
+    panel = left.sort_values('date', kind='mergesort').reset_index(drop=True)
+    right = right[['asset_id', 'tidemark_id', 'date', value_col]] \
+                 .dropna(subset=[value_col])
+    if tidemark_ids is None:
+        tidemark_ids = sorted(right['tidemark_id'].unique())
+    tidemark_ids = [int(t) for t in tidemark_ids]
+    columns = [maps.tm_id_name_map.get(t, t) if names else t
+               for t in tidemark_ids]
+    panel = panel.drop(columns=[c for c in columns if c in panel.columns])
+    if not tidemark_ids:
+        return panel.set_index(['asset_id', 'date']).sort_index()
+
+    # One merge over every (row, tidemark) pair. merge_asof keeps the left
+    # order, so the values reshape back to one column per tidemark.
+    count = len(tidemark_ids)
+    pairs = pd.DataFrame({
+        'date': np.repeat(pd.to_datetime(panel['date']).to_numpy(), count),
+        'asset_id': np.repeat(panel['asset_id'].to_numpy(dtype='int64'), count),
+        'tidemark_id': np.tile(np.array(tidemark_ids, dtype='int64'),
+                               len(panel))})
+    right = right[right['tidemark_id'].isin(tidemark_ids)]
+    right = pd.DataFrame({
+        'date': pd.to_datetime(right['date']).to_numpy(),
+        'asset_id': right['asset_id'].to_numpy(dtype='int64'),
+        'tidemark_id': right['tidemark_id'].to_numpy(dtype='int64'),
+        value_col: right[value_col].to_numpy()}) \
+        .sort_values('date', kind='mergesort')
+    merged = pd.merge_asof(pairs, right, on='date',
+                           by=['asset_id', 'tidemark_id'],
+                           tolerance=tolerance, allow_exact_matches=True)
+    values = merged[value_col].to_numpy().reshape(len(panel), count)
+    panel = pd.concat([panel, pd.DataFrame(values, columns=columns,
+                                           index=panel.index)], axis=1)
+    return panel.set_index(['asset_id', 'date']).sort_index()
+
+@metrics.timed
+def asof_panel(asset_ids=None, tidemark_ids=None, start=None, end=None,
+               tolerance=None, daily: bool = False, names: bool = False,
+               price_col: str = 'price', value_col: str = 'value',
+               float32: bool = False) -> pd.DataFrame:
+    """Price history with the as-of value of every tidemark on each date.
+
+    Parameters
+    ==========
+    asset_ids: list
+        Restrict to these assets; all assets by default.
+    tidemark_ids: list
+        Tidemarks to join; every tidemark present by default.
+    start, end: datetime.date
+        Inclusive date range of the price rows.
+    tolerance:
+        Staleness limit (`pd.Timedelta`, offset string such as '100D', or
+        days). Tidemark values older than this are reported as NaN.
+    daily: bool
+        Join `tidemark_history_daily` instead of `tidemark_history`.
+    names: bool
+        Name the tidemark columns by tidemark name rather than id.
+
+    Returns
+    =======
+    pandas.DataFrame
+        Indexed by `(asset_id, date)` with `price_col` and one column per
+        tidemark; every requested tidemark has a column, all NaN when it has
+        no value within `tolerance`.
+    """
+    price_table = models.PriceHistory
+    prices = filter_frame(price_table,
+                          _criterion(price_table, asset_ids, None, start, end),
+                          float32=float32)
+    tidemark_table = models.TidemarkDaily if daily else models.TidemarkHistory
+    history = tidemark_frame(tidemark_table, asset_ids, tidemark_ids, start, end,
+                             tolerance=tolerance, float32=float32)
+    return asof_join(prices[[price_col]], history, tolerance=tolerance,
+                     value_col=value_col, names=names, tidemark_ids=tidemark_ids)
@@ -0,0 +1,289 @@
+"""Incremental multi-horizon returns and pop/drop flags over `price_history`.
+
+Computes the statistics described by the `CurrentBuoy`, `PriceMovement`,
+`Pop` and `Drop` view definitions in `models.py` for every asset at once:
+
+    mo_01 .. yr_20  trailing returns over 21, 126, 252, 1260, 2520 and 5040
+                    trading days
+    wtd_avg         weighted average of the available horizon returns
+    pop / drop      the return over `mvmt_int_days` is at least `threshold`
+                    (pop) or at most `-threshold` (drop)
+
+The engine keeps, per asset, a ring buffer of the last prices covering the
+longest horizon plus a count of rows seen. Appending prices only reads the
+ring at the lagged positions of the new rows, so an update costs
+O(new rows) regardless of how much history an asset has. The state is saved
+under `TTG_DATA_DIRECTORY/buoy/`. Restated (not appended) prices require
+`reset()` and a full refresh.
+
+Methods
+-------
+refresh(db_table)->int, int
+    Read the prices appended since the last refresh, compute their metrics
+    and upsert the pop/drop rows into `db_table`.
+
+check_target(db_table)
+    Validate that `db_table` has the columns `refresh` writes.
+
+BuoyEngine.update(prices)->pandas.DataFrame
+    Metrics of new `(asset_id, date)` price rows, updating the state.
+
+BuoyEngine.events(metrics)->pandas.DataFrame
+    Pop/drop rows in the `CurrentBuoy` layout.
+"""
+import os
+import numpy as np
+import pandas as pd
+from .. import data_file_dir, logger
+from . import models
+from . import metrics
+from . import loader
+from .functions import filter_frame, get_unique_cols
+
+state_dir = os.path.join(data_file_dir, 'buoy')
+
+horizons = {'mo_01': 21, 'mo_06': 126, 'yr_01': 252,
+            'yr_05': 1260, 'yr_10': 2520, 'yr_20': 5040}
+
+# Layout of the `CurrentBuoy` rows `refresh` writes.
+event_keys = ['asset_id', 'date', 'pop', 'mvmt_int_days']
+event_cols = ['price_id', 'price'] + list(horizons) + ['wtd_avg']
+
+class BuoyEngine:
+    """Per-asset ring buffers of recent prices.
+
+    Parameters
+    ==========
+    movement_days: tuple
+        Intervals (trading days) over which pops and drops are flagged.
+    threshold: float
+        Return that counts as a pop (or, negated, a drop).
+    weights: dict
+        Weight of each horizon in `wtd_avg`; equal weights by default.
+    slack: int
+        Extra ring slots; new rows are applied in rounds of `slack` rows per
+        asset.
+    """
+    def __init__(self, movement_days=(1, 5, 21), threshold: float = 0.05,
+                 weights: dict = None, slack: int = 64):
+        self.movement_days = tuple(int(d) for d in movement_days)
+        self.threshold = threshold
+        self.weights = weights or {name: 1.0 for name in horizons}
+        self.slack = slack
+        self.capacity = max(list(horizons.values()) + list(self.movement_days)) \
+                        + slack
+        self.asset_ids = np.empty(0, dtype='int64')
+        self.counts = np.empty(0, dtype='int64')
+        self.last_dates = np.empty(0, dtype='datetime64[D]')
+        self.ring = np.empty((0, self.capacity), dtype='float64')
+
+    ## STATE
+    def _add_assets(self, asset_ids: np.ndarray):
+        new = np.setdiff1d(asset_ids, self.asset_ids)
+        if not len(new):
+            return
+        positions = np.searchsorted(self.asset_ids, new)
+        self.asset_ids = np.insert(self.asset_ids, positions, new)
+        self.counts = np.insert(self.counts, positions, 0)
+        self.last_dates = np.insert(self.last_dates, positions,
+                                    np.datetime64('NaT', 'D'))
+        self.ring = np.insert(self.ring, positions, np.nan, axis=0)
+
+    def last_date(self) -> pd.Series:
+        """Latest date applied per asset."""
+        return pd.Series(self.last_dates, index=pd.Index(self.asset_ids,
+                                                         name='asset_id'))
+
+    def save(self, directory: str = state_dir):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f"state.{os.getpid()}.tmp.npz")
+        np.savez(tmp_path, asset_ids=self.asset_ids, counts=self.counts,
+                 last_dates=self.last_dates, ring=self.ring,
+                 movement_days=np.array(self.movement_days),
+                 threshold=np.array(self.threshold))
+        os.replace(tmp_path, os.path.join(directory, 'state.npz'))
+
+    @classmethod
+    def load(cls, directory: str = state_dir, **kwargs):
+        """The saved engine, or a new one when there is no saved state."""
+        path = os.path.join(directory, 'state.npz')
+        if not os.path.exists(path):
+            return cls(**kwargs)
+        with np.load(path) as state:
+            engine = cls(movement_days=state['movement_days'].tolist(),
+                         threshold=float(state['threshold']), **kwargs)
+            if state['ring'].shape[1] != engine.capacity:
+                logger.warning("Ignoring buoy state with a different ring size.")
+                return engine
+            engine.asset_ids = state['asset_ids']
+            engine.counts = state['counts']
+            engine.last_dates = state['last_dates']
+            engine.ring = state['ring']
+        return engine
+
+    ## UPDATE
+    def update(self, prices: pd.Series) -> pd.DataFrame:
+        """Apply new prices and return their metrics.
+
+        Parameters
+        ==========
+        prices: pandas.Series
+            Prices indexed by `(asset_id, date)`. Rows dated on or before an
+            asset's last applied date are ignored.
+
+        Returns
+        =======
+        pandas.DataFrame
+            Indexed by `(asset_id, date)` with `price`, one column per
+            horizon, `wtd_avg` and a `mvmt_<days>` return per movement
+            interval.
+        """
+        prices = prices.dropna().sort_index()
+        asset_col = prices.index.get_level_values('asset_id').values.astype('int64')
+        date_col = prices.index.get_level_values('date').values \
+                         .astype('datetime64[D]')
+        self._add_assets(np.unique(asset_col))
+        rows = np.searchsorted(self.asset_ids, asset_col)
+        last = self.last_dates[rows]
+        new = np.isnat(last) | (date_col > last)
+        rows, asset_col, date_col = rows[new], asset_col[new], date_col[new]
+        price = prices.to_numpy(dtype='float64')[new]
+
+        # Position of each row within its asset's new rows (input is sorted).
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]]) \
+                 if len(rows) else np.empty(0, dtype='int64')
+        rank = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+        sequence = self.counts[rows] + rank
+
+        lags = dict(horizons)
+        lags.update({f"mvmt_{d}": d for d in self.movement_days})
+        output = {name: np.full(len(rows), np.nan) for name in lags}
+        # Within a round no row overwrites a slot a later row still has to read.
+        for round_ in range(int(rank.max()) // self.slack + 1 if len(rank) else 0):
+            selected = rank // self.slack == round_
+            r, s = rows[selected], sequence[selected]
+            self.ring[r, s % self.capacity] = price[selected]
+            for name, lag in lags.items():
+                lagged = self.ring[r, (s - lag) % self.capacity]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    output[name][selected] = np.where(
+                        s >= lag, price[selected] / lagged - 1, np.nan)
+
+        np.add.at(self.counts, rows, 1)
+        self.last_dates[rows] = date_col
+
+        frame = pd.DataFrame({'price': price, **output},
+                             index=pd.MultiIndex.from_arrays(
+                                 [asset_col, date_col.astype('datetime64[ns]')],
+                                 names=['asset_id', 'date']))
+        returns = frame[list(horizons)]
+        weights = pd.Series(self.weights).reindex(list(horizons)).fillna(0)
+        available = returns.notna() * weights.values
+        frame['wtd_avg'] = (returns.fillna(0) * weights.values).sum(axis=1) \
+                           / available.sum(axis=1).replace(0, np.nan)
+        return frame
+
+    def events(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """Pop and drop rows of `update` output in the `CurrentBuoy` layout.
+
+        Returns
+        =======
+        pandas.DataFrame
+            Indexed by `(asset_id, date, pop, mvmt_int_days)` with `price`,
+            the horizon returns and `wtd_avg`.
+        """
+        columns = ['price'] + list(horizons) + ['wtd_avg']
+        parts = []
+        for days in self.movement_days:
+            movement = frame[f"mvmt_{days}"]
+            flagged = movement.abs() >= self.threshold
+            parts.append(frame.loc[flagged, columns]
+                              .assign(pop=movement[flagged] > 0,
+                                      mvmt_int_days=days))
+        if not parts:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(parts) \
+                 .set_index(['pop', 'mvmt_int_days'], append=True) \
+                 .sort_index()
+
+def check_target(db_table):
+    """Raise `ValueError` unless `db_table` can hold `refresh` rows.
+
+    The table needs the `event_keys` as its unique constraint (the upsert
+    conflict target) and every column of `event_keys` and `event_cols`.
+    """
+    table_object, unique_cols, _ = get_unique_cols(db_table=db_table)
+    missing = [c for c in event_keys + event_cols if c not in table_object.c]
+    if missing:
+        raise ValueError(f"{table_object.name} lacks the buoy columns {missing}.")
+    if sorted(unique_cols) != sorted(event_keys):
+        raise ValueError(f"{table_object.name} must be unique on {event_keys}, "
+                         f"not {unique_cols}.")
+
+def _price_ids(rows: pd.DataFrame, events: pd.DataFrame) -> np.ndarray:
+    """`price_history.id` of each event's `(asset_id, date)`."""
+    ids = pd.Series(rows['id'].to_numpy(dtype='int64'),
+                    index=pd.MultiIndex.from_arrays(
+                        [rows.index.get_level_values('asset_id').astype('int64'),
+                         rows.index.get_level_values('date')],
+                        names=['asset_id', 'date']))
+    return ids.reindex(events.index.droplevel(['pop', 'mvmt_int_days'])) \
+              .to_numpy()
+
+def reset(directory: str = state_dir):
+    """Forget the saved state; the next `refresh` recomputes everything."""
+    path = os.path.join(directory, 'state.npz')
+    if os.path.exists(path):
+        os.remove(path)
+
+@metrics.timed
+def refresh(db_table, asset_ids=None, batch_assets: int = 500,
+            price_col: str = 'price', engine: BuoyEngine = None,
+            debug: bool = False) -> (int, int):
+    """Apply the prices appended since the last refresh and write the events.
+
+    Prices are read in groups of `batch_assets` assets, only past the
+    earliest date the saved state has for the group, and the pop/drop rows
+    are upserted into `db_table` (e.g. `buoy_history`) with
+    `loader.copy_upsert`. The state is saved once all groups are applied;
+    if a run fails, rerunning it rewrites the same rows.
+
+    `db_table` must have the `CurrentBuoy` layout: unique on `asset_id`,
+    `date`, `pop` and `mvmt_int_days`, with `price_id` (the
+    `price_history.id` of the row, filled in here), `price`, the horizon
+    returns and `wtd_avg`. It is checked with `check_target` before anything
+    is read.
+
+    Returns
+    =======
+    inserted, updated: int
+        Rows written to `db_table`.
+    """
+    check_target(db_table)
+    engine = BuoyEngine.load() if engine is None else engine
+    price_table = models.PriceHistory
+    if asset_ids is None:
+        asset_ids = [a for a, in models.session.query(price_table.asset_id)
+                                               .distinct()]
+    asset_ids = np.unique(np.asarray(asset_ids, dtype='int64'))
+    last_dates = engine.last_date()
+
+    inserted = updated = 0
+    for i in range(0, len(asset_ids), batch_assets):
+        group = asset_ids[i: i + batch_assets]
+        criterion = [price_table.asset_id.in_(group.tolist())]
+        known = last_dates.reindex(group)
+        if len(known) and known.notna().all():
+            criterion.append(price_table.date > known.min().date())
+        rows = filter_frame(price_table, criterion, cached=False)
+        frame = engine.update(rows[price_col])
+        if debug:
+            print(f"Buoy: {len(frame)} new price rows for {len(group)} assets.")
+        events = engine.events(frame)
+        if events.empty:
+            continue
+        events['price_id'] = _price_ids(rows, events)
+        counts = loader.copy_upsert(events, db_table, ignore_nulls=True)
+        inserted, updated = inserted + counts[0], updated + counts[1]
+    engine.save()
+    return inserted, updated
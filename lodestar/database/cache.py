@@ -0,0 +1,216 @@
+"""Query result cache with per-table write-through invalidation.
+
+Results of `all_frame`/`filter_frame` are cached under a hash of the compiled SQL statement, its parameters and the
+current *generation* of each table it reads. Writes made through
+`load_objects` or `copy_upsert` bump the table's generation, so entries for
+that table are never served again, in this process or (with a disk tier)
+in any other process sharing the directory.
+
+ORM results (`all_query`/`filter_query`) are not cached: instances belong to
+the session that loaded them and are mutable.
+
+The memory tier is an LRU bounded by `max_bytes`. The optional disk tier
+pickles dataframes under `directory`, bounded by `max_disk_bytes`. Caching is off until `enable()` is called.
+
+Generations only move on writes this package makes. Reads that feed a write
+or must see rows loaded by other clients (`existing_frame`, the mirror,
+buoy and materialize refreshes) pass `cached=False` and always hit the
+database.
+
+Methods
+-------
+enable(max_bytes, directory=None, max_disk_bytes), disable()
+    Turn the cache on or off.
+
+invalidate(table_name)
+    Bump a table's generation and drop its in-memory entries.
+
+clear()
+    Drop every entry.
+"""
+import os
+import uuid
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from .. import data_file_dir, logger
+from . import get_engine
+
+default_directory = os.path.join(data_file_dir, 'query_cache')
+
+class QueryCache:
+    def __init__(self):
+        self.enabled = False
+        self.max_bytes = 0
+        self.directory = None
+        self.max_disk_bytes = 0
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()  # key -> (tables, nbytes, value)
+        self._bytes = 0
+        self._generations = {}
+
+    ## GENERATIONS
+    def _generation_path(self, table_name):
+        return os.path.join(self.directory, '_generations', table_name)
+
+    def generation(self, table_name: str) -> str:
+        """Current generation token of `table_name`."""
+        if self.directory:
+            try:
+                with open(self._generation_path(table_name)) as fh:
+                    return fh.read()
+            except FileNotFoundError:
+                pass
+        return self._generations.setdefault(table_name, '0')
+
+    def invalidate(self, table_name: str):
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._generations[table_name] = token
+            for key in [k for k, (tables, _, _) in self._entries.items()
+                        if table_name in tables]:
+                self._evict(key)
+        if self.directory:
+            path = self._generation_path(table_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as fh:
+                fh.write(token)
+            os.replace(tmp_path, path)
+
+    ## KEYS
+    def key(self, statement, tables: list, kind: str) -> str:
+        compiled = statement.compile(dialect=get_engine().dialect)
+        parts = [kind, str(compiled), repr(sorted(compiled.params.items()))]
+        parts += [f"{t}={self.generation(t)}" for t in sorted(tables)]
+        return hashlib.sha1('\x1f'.join(parts).encode()).hexdigest()
+
+    ## MEMORY TIER
+    def _nbytes(self, value) -> int:
+        return int(value.memory_usage(index=True).sum())
+
+    def _evict(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def _put_memory(self, key, tables, value):
+        nbytes = self._nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (frozenset(tables), nbytes, value)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    ## DISK TIER
+    def _disk_path(self, key):
+        return os.path.join(self.directory, f"{key}.pickle")
+
+    def _get_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as fh:
+                value = pickle.load(fh)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable query cache entry {path}: {e}")
+            return None
+        os.utime(path)
+        return value
+
+    def _put_disk(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as fh:
+            pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self._prune_disk()
+
+    def _prune_disk(self):
+        """Remove least recently used files past `max_disk_bytes`."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    ## LOOKUP
+    def fetch(self, statement, tables: list, load, kind: str = 'frame'):
+        """Return the cached dataframe of `statement`, or `load()` it and
+        cache it.
+
+        Dataframes are returned as copies so callers cannot alter the cache.
+        """
+        if not self.enabled:
+            return load()
+        key = self.key(statement, tables, kind)
+        value = self._get_memory(key)
+        if value is None and self.directory:
+            value = self._get_disk(key)
+            if value is not None:
+                self._put_memory(key, tables, value)
+        if value is None:
+            value = load()
+            self._put_memory(key, tables, value)
+            if self.directory:
+                self._put_disk(key, value)
+        return value.copy()
+
+    def clear(self, disk: bool = True):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if disk and self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.pickle'):
+                    os.remove(os.path.join(self.directory, name))
+
+query_cache = QueryCache()
+
+def enable(max_bytes: int = 512 * 2 ** 20, directory=None,
+           max_disk_bytes: int = 4 * 2 ** 30):
+    """Cache query results in memory, and on disk if `directory` is given.
+
+    `directory=True` uses `TTG_DATA_DIRECTORY/query_cache`.
+    """
+    query_cache.max_bytes = max_bytes
+    query_cache.directory = default_directory if directory is True else directory
+    query_cache.max_disk_bytes = max_disk_bytes
+    query_cache.enabled = True
+
+def disable():
+    """Stop caching and drop the memory tier; disk entries are kept."""
+    query_cache.enabled = False
+    query_cache.clear(disk=False)
+
+def fetch(statement, tables: list, load, kind: str = 'frame'):
+    return query_cache.fetch(statement, tables, load, kind=kind)
+
+def invalidate(table_name: str):
+    query_cache.invalidate(table_name)
+
+def clear(disk: bool = True):
+    query_cache.clear(disk=disk)
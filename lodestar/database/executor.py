@@ -0,0 +1,121 @@
+"""Parallel per-asset ingestion.
+
+Fans `update_database_object`-style loads for many assets out across a
+thread or process pool. Each worker uses its own session (the thread-local
+`models.session`, or a fresh engine in each process), concurrency is bounded
+by `max_workers`, and the per-asset outcomes are aggregated into a single
+dataframe.
+
+Methods
+-------
+update_assets(frames, db_table)->pandas.DataFrame
+    Load `{asset_id: import_df}` into `db_table` concurrently.
+
+ingest_asset(asset_id, import_df, table_name)->IngestResult
+    Load a single asset; the unit of work run by each worker.
+"""
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                as_completed)
+import pandas as pd
+from tqdm import tqdm
+from . import dispose_engine, pool_size, max_overflow
+from . import models
+from . import loader
+from .functions import compare_to_db, load_objects
+from .. import logger
+
+IngestResult = namedtuple('IngestResult',
+                          ['asset_id', 'inserted', 'updated', 'seconds', 'error'])
+
+def _model(table_name: str):
+    """Resolve a model by table name (model classes are not picklable)."""
+    return getattr(models.Base.classes, table_name)
+
+def ingest_asset(asset_id, import_df: pd.DataFrame, table_name: str,
+                 method: str = 'copy', insert_only: bool = False) -> IngestResult:
+    """Load one asset's import dataframe into `table_name`.
+
+    With `method='bulk'` the existing rows within the import's key range are
+    read and diffed with `compare_to_db`; with `method='copy'` the rows are
+    upserted on the server.
+    Errors are caught and reported in the result rather than raised.
+    """
+    start = time.perf_counter()
+    db_table = _model(table_name)
+    try:
+        if method == 'copy':
+            inserted, updated = loader.copy_upsert(import_df, db_table,
+                                                   insert_only=insert_only)
+        else:
+            insert_objects, update_objects = compare_to_db(
+                import_df, None, db_table, insert_only=insert_only)
+            inserted, updated = load_objects(insert_objects, update_objects,
+                                             db_table)
+        return IngestResult(asset_id, inserted, updated,
+                            time.perf_counter() - start, None)
+    except Exception as e:
+        models.session.rollback()
+        logger.error(f"Loading {table_name} for asset {asset_id} failed: {e!r}")
+        return IngestResult(asset_id, 0, 0, time.perf_counter() - start, repr(e))
+    finally:
+        models.session.remove()
+
+def _init_process():
+    # Connections inherited through fork belong to the parent: start a new
+    # pool without closing them.
+    dispose_engine(close=False)
+
+def update_assets(frames: dict, db_table, max_workers: int = None,
+                  processes: bool = False, method: str = 'copy',
+                  insert_only: bool = False, progress: bool = True) -> pd.DataFrame:
+    """Load `frames` (`{asset_id: import_df}`) into `db_table` in parallel.
+
+    Parameters
+    ==========
+    frames: dict
+        Import dataframes keyed by asset id.
+    db_table: sqlalchemy.ext.declarative.api.DeclarativeMeta
+        SQLAlchemy Object Relation Model of the target table.
+    max_workers: int
+        Concurrent workers. Defaults to what the connection pool allows
+        (`TTG_POOL_SIZE + TTG_MAX_OVERFLOW`), capped at the CPU count for
+        process pools.
+    processes: bool
+        Use a process pool instead of a thread pool.
+    method: str
+        'copy' (server-side upsert) or 'bulk' (`compare_to_db` + mappings).
+
+    Returns
+    =======
+    pandas.DataFrame
+        One row per asset with `inserted`, `updated`, `seconds` and `error`,
+        indexed by asset id.
+    """
+    if max_workers is None:
+        max_workers = pool_size + max_overflow
+        if processes:
+            max_workers = min(max_workers, os.cpu_count() or 1)
+    table_name = db_table.__table__.name
+    if processes:
+        executor = ProcessPoolExecutor(max_workers=max_workers,
+                                       initializer=_init_process)
+    else:
+        executor = ThreadPoolExecutor(max_workers=max_workers,
+                                      thread_name_prefix='lodestar-ingest')
+
+    results = []
+    with executor:
+        futures = [executor.submit(ingest_asset, asset_id, import_df, table_name,
+                                   method, insert_only)
+                   for asset_id, import_df in frames.items()]
+        for future in tqdm(as_completed(futures), total=len(futures),
+                           desc=f"Loading {table_name}", leave=False,
+                           disable=not progress):
+            results.append(future.result())
+
+    return pd.DataFrame(results, columns=IngestResult._fields) \
+             .set_index('asset_id') \
+             .sort_index()
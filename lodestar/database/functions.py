@@ -11,25 +11,43 @@ compare_to_db(import_df, exist_db_model)->list, list:
 update_database_object(import_df, db_table):
     Export items to database as insert or update statements.
 
+load_objects(insert_objects, update_objects, db_table)->int, int
+    Write `compare_to_db` mappings in adaptively sized, committed batches.
+
 collection_to_dataframe(query_results)->pandas.DataFrame
     Returns items in a models collection attribute as a dataframe.
     
 all_query(table)->list:
     All-Query - Returns all records for given table object
+
+all_frame(table)->pandas.DataFrame, filter_frame(table, criterion)->pandas.DataFrame
+    Columnar versions of `all_query` and `filter_query` that skip ORM objects.
+
+iter_frames(table, criterion, chunksize)->iterator
+    Server-side cursor reader yielding dataframe chunks in primary key order.
+
+existing_frame(import_df, table)->pandas.DataFrame
+    Only the existing records an import dataframe's unique keys can match.
 """
 from tqdm import tqdm
-import pandas as pd
-import decimal
+import time
 import datetime as dt
-from sqlalchemy import types, UniqueConstraint, PrimaryKeyConstraint
-from .models import session
+import functools
+import numpy as np
+import pandas as pd
+from sqlalchemy import (types, select, values, column, and_, exc,
+                        UniqueConstraint, PrimaryKeyConstraint)
+from . import get_engine
+from . import models
+from . import loader
+from . import metrics
+from . import cache
 from .. import logger, debug
 
+@metrics.timed
 def all_query(db_table):
     """All-Query - Returns all records for given table object."""
-    return session.query(db_table)\
-                  .order_by(*[c for c in db_table.__table__.primary_key.columns])\
-                  .all()
+    return filter_query(db_table, [])
 
 def greater(db_table, col:str, val, inclusive: bool = False):
     if inclusive:
@@ -44,26 +62,77 @@ def less(db_table, col:str, val, inclusive: bool = False):
 def equals(db_table, col:str, val):
     return getattr(db_table, col) == val
 
+@metrics.timed
 def filter_query(db_table, criterion):
-    q = session.query(db_table)
+    q = models.session.query(db_table)
     for criteria in criterion:
         q = q.filter(criteria)
 
-    return q.order_by(*[c for c in db_table.__table__.primary_key.columns]).all()
+    q = q.order_by(*[c for c in db_table.__table__.primary_key.columns])
+    # ORM objects belong to their session and are never cached.
+    return q.all()
 
-    
+def select_table(db_table, criterion=()):
+    """Core `select` of every column of `db_table`, in primary key order."""
+    table_object = db_table.__table__
+    statement = select(table_object)
+    for criteria in criterion:
+        statement = statement.where(criteria)
+    return statement.order_by(*[c for c in table_object.primary_key.columns])
+
+@metrics.timed
+def all_frame(db_table, drop_last_modified=True, float32=False,
+              cached: bool = True)->pd.DataFrame:
+    """All-Query returned as a dataframe, without building ORM objects."""
+    return filter_frame(db_table, [], drop_last_modified=drop_last_modified,
+                        float32=float32, cached=cached)
+
+@metrics.timed
+def filter_frame(db_table, criterion, drop_last_modified=True,
+                 float32=False, cached: bool = True)->pd.DataFrame:
+    """`filter_query` returned as a dataframe, without building ORM objects.
+
+    Same result as `collection_to_dataframe(filter_query(db_table, criterion))`
+    but the rows are fetched as raw tuples and loaded column by column.
+    `cached=False` always reads the database, for reads that must see writes
+    made outside this process (see `cache`).
+    """
+    statement = select_table(db_table, criterion)
 
-def get_unique_cols(db_table=None, query_results=None):
-    """Returns all columns under a tables Unique Constraint.
-    
-    These columns are used as the index columns when creating a dataframe and 
-    when comparing to the database for new values.
+    def load():
+        result = models.session.execute(statement)
+        columns = list(result.keys())
+        return rows_to_dataframe(result.fetchall(), columns, db_table,
+                                 drop_last_modified=drop_last_modified,
+                                 float32=float32)
+
+    if not cached:
+        return load()
+    return cache.fetch(statement, [db_table.__table__.name], load,
+                       kind=f"frame:{drop_last_modified}:{float32}")
+
+
+def iter_frames(db_table, criterion=(), chunksize: int = 100000,
+                drop_last_modified=True, float32=False):
+    """Yield `filter_frame` results in chunks of `chunksize` rows.
+
+    Rows are streamed from a server-side cursor in primary key order, so only
+    one chunk is held in memory at a time. The chunks can be passed directly
+    as `db_records` to `compare_to_db` and `update_database_object`.
     """
-    if db_table:
-        table_object = db_table.__table__
-    else:
-        table_object = query_results[0].__table__
-    
+    with get_engine().connect() as connection:
+        result = connection.execution_options(stream_results=True,
+                                              max_row_buffer=chunksize)\
+                           .execute(select_table(db_table, criterion))
+        columns = list(result.keys())
+        for rows in result.partitions(chunksize):
+            yield rows_to_dataframe(rows, columns, db_table,
+                                    drop_last_modified=drop_last_modified,
+                                    float32=float32)
+
+@functools.lru_cache(maxsize=None)
+def _table_keys(table_object)->(tuple, tuple):
+    """Unique constraint and primary key column names, cached per table."""
     table_cons = table_object.constraints
     unique_cols = sorted(set([
                 col.name for cols in [
@@ -73,11 +142,93 @@ def get_unique_cols(db_table=None, query_results=None):
             col.name for cols in [
                 c.columns for c in table_cons if type(c) is PrimaryKeyConstraint
             ] for col in cols]))
+    return tuple(unique_cols), tuple(primary_keys)
+
+def get_unique_cols(db_table=None, query_results=None):
+    """Returns all columns under a tables Unique Constraint.
+    
+    These columns are used as the index columns when creating a dataframe and 
+    when comparing to the database for new values.
+    """
+    if db_table:
+        table_object = db_table.__table__
+    else:
+        table_object = query_results[0].__table__
+
+    unique_cols, primary_keys = _table_keys(table_object)
     return table_object, list(unique_cols), list(primary_keys)
 
+@functools.lru_cache(maxsize=None)
+def dtype_plan(table_object, float32: bool = False)->dict:
+    """Compact dataframe dtype for each column of the table, cached per table.
+
+    Integer columns (ids) become nullable `Int32` (`Int64` for big integers),
+    numeric and float values float64 (float32 with `float32=True`), dates
+    `datetime64[ns]` (`datetime64[ns, UTC]` for timezone-aware columns such
+    as `last_modified`), booleans nullable `boolean`, and text key columns (in
+    the unique constraint or a foreign key, e.g. `asset`, `tidemark`)
+    `category`. Other columns are kept as objects.
+
+    float32 values are meant for analysis; `compare_to_db` should be given
+    float64 records so that values are compared at full precision.
+    """
+    unique_cols, _ = _table_keys(table_object)
+    plan = {}
+    for c in table_object.columns:
+        if isinstance(c.type, types.BigInteger):
+            plan[c.name] = 'Int64'
+        elif isinstance(c.type, types.Integer):
+            plan[c.name] = 'Int32'
+        elif isinstance(c.type, (types.Numeric, types.Float)):
+            plan[c.name] = 'float32' if float32 else 'float64'
+        elif isinstance(c.type, types.DateTime) and c.type.timezone:
+            plan[c.name] = 'datetime64[ns, UTC]'
+        elif isinstance(c.type, (types.Date, types.DateTime)):
+            plan[c.name] = 'datetime64[ns]'
+        elif isinstance(c.type, types.Boolean):
+            plan[c.name] = 'boolean'
+        elif isinstance(c.type, types.String) \
+                and (c.name in unique_cols or c.foreign_keys):
+            plan[c.name] = 'category'
+        else:
+            plan[c.name] = object
+    return plan
+
+def build_column(values, dtype):
+    """Convert a sequence of python values straight into `dtype`."""
+    if dtype in ('float64', 'float32', 'datetime64[ns]'):
+        # None becomes NaN/NaT and Decimals are converted in the same pass.
+        return np.array(values, dtype=dtype)
+    if dtype == 'datetime64[ns, UTC]':
+        # numpy has no timezones; convert aware values to UTC instead.
+        return pd.to_datetime(list(values), utc=True).array
+    if dtype == 'category':
+        return pd.Categorical(values)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    if dtype is object:
+        return array
+    return pd.array(array, dtype=dtype)
+
+def _indexed(data: dict, idx_cols: list)->pd.DataFrame:
+    # Key columns are not nullable; plain integer levels index faster.
+    for col in idx_cols:
+        if isinstance(data.get(col), pd.arrays.IntegerArray) \
+                and not data[col].isna().any():
+            data[col] = data[col].to_numpy(dtype='int64')
+    dataframe = pd.DataFrame(data, columns=list(data))
+    try:
+        return dataframe.set_index(idx_cols)\
+                        .sort_index()
+    except KeyError as e:
+        logger.log(level=1, msg=e)
+        return dataframe
+
+@metrics.timed
 def collection_to_dataframe(query_results,
                             db_table=None,
-                            drop_last_modified=True)->pd.DataFrame:
+                            drop_last_modified=True,
+                            float32=False)->pd.DataFrame:
     """Returns items in a models collection attribute as a dataframe.
 
     This function takes the list of database objects and extracts their
@@ -89,6 +240,8 @@ def collection_to_dataframe(query_results,
     query_results : list
         A list of database objects. Often the value of a 
         `<model>`.`<dependent_table>_collection` attribute.
+    float32 : bool
+        Hold numeric values as float32 (see `dtype_plan`).
 
     Returns
     -------
@@ -99,31 +252,190 @@ def collection_to_dataframe(query_results,
     # Set unique columns as index columns
     table_object, idx_cols, _ = get_unique_cols(db_table=db_table, 
                                                 query_results=query_results)
+    plan = dtype_plan(table_object, float32)
+
+    # Build column-wise, straight into each column's planned dtype.
+    data = {
+        c.name: build_column([getattr(q, c.name) for q in query_results],
+                             plan[c.name])
+            for c in table_object.columns
+            if not (drop_last_modified and c.name == 'last_modified')}
+    return _indexed(data, idx_cols)
+
+@metrics.timed
+def rows_to_dataframe(rows, columns, db_table,
+                      drop_last_modified=True, float32=False)->pd.DataFrame:
+    """Build an indexed dataframe directly from raw result tuples.
+
+    Each column is converted once, straight into its `dtype_plan` dtype, and
+    the frame is indexed by the table's unique key columns.
+    """
+    table_object, idx_cols, _ = get_unique_cols(db_table=db_table)
+    plan = dtype_plan(table_object, float32)
+    column_values = list(zip(*rows)) if rows else [()] * len(columns)
+
+    data = {}
+    for name, items in zip(columns, column_values):
+        if drop_last_modified and name == 'last_modified':
+            continue
+        data[name] = build_column(items, plan.get(name, object))
+    del column_values
+    return _indexed(data, idx_cols)
+
+def _import_keys(import_df: pd.DataFrame, idx_cols: list) -> pd.DataFrame:
+    """The unique key columns of an import dataframe, from index or columns."""
+    if all(c in import_df.index.names for c in idx_cols):
+        keys = import_df.index.to_frame(index=False)
+    else:
+        keys = import_df.reset_index()
+    return keys[idx_cols].drop_duplicates()
+
+def _key_values(series: pd.Series, sql_type) -> list:
+    """Python values of a key column suited to the column's SQL type."""
+    if isinstance(sql_type, types.Date):
+        return [v.date() for v in pd.to_datetime(series)]
+    if isinstance(sql_type, types.Integer):
+        return [int(v) for v in series]
+    return series.tolist()
+
+def key_criterion(import_df: pd.DataFrame, db_table, max_in: int = 1000)->list:
+    """Criteria bounding `db_table` to the keys present in `import_df`.
+
+    Date and datetime key columns are bounded by their min/max; other key
+    columns (ids, names) by an `IN` list, or by min/max when they have more
+    than `max_in` distinct values.
+    """
+    table_object, idx_cols, _ = get_unique_cols(db_table=db_table)
+    keys = _import_keys(import_df, idx_cols)
+    criterion = []
+    for col in idx_cols:
+        sql_column = table_object.c[col]
+        distinct = keys[col].dropna().drop_duplicates()
+        ranged = isinstance(sql_column.type, (types.Date, types.DateTime)) \
+                 or len(distinct) > max_in
+        if ranged:
+            low, high = _key_values(pd.Series([distinct.min(), distinct.max()]),
+                                    sql_column.type)
+            criterion.append(sql_column.between(low, high))
+        else:
+            criterion.append(sql_column.in_(_key_values(distinct,
+                                                        sql_column.type)))
+    return criterion
+
+def values_select(import_df: pd.DataFrame, db_table):
+    """Select the rows of `db_table` joined to the import keys as `VALUES`."""
+    table_object, idx_cols, _ = get_unique_cols(db_table=db_table)
+    keys = _import_keys(import_df, idx_cols).dropna()
+    key_values = values(*[column(c, table_object.c[c].type) for c in idx_cols],
+                        name='import_keys') \
+        .data(list(zip(*[_key_values(keys[c], table_object.c[c].type)
+                         for c in idx_cols])))
+    return select(table_object) \
+        .join(key_values, and_(*[table_object.c[c] == key_values.c[c]
+                                 for c in idx_cols])) \
+        .order_by(*[c for c in table_object.primary_key.columns])
+
+@metrics.timed
+def existing_frame(import_df: pd.DataFrame, db_table, mode: str = 'range',
+                   drop_last_modified=True)->pd.DataFrame:
+    """Fetch only the existing records that `import_df` can match.
 
-    dataframe = pd.DataFrame([
-        {k:v for k,v in q.__dict__.items() if k in table_object.columns} \
-            for q in query_results])
-            
-    if drop_last_modified and ('last_modified' in dataframe.columns):
-        dataframe = dataframe.drop(columns='last_modified')
-    
-    # Convert decimal types to float.
-    dtype_dict = {
-        c.name: float 
-            if c.type.python_type in [decimal.Decimal, int]
-            else 'datetime64' if c.type.python_type in [dt.date, dt.datetime]
-            else c.type.python_type
-        for c in table_object.columns if c.name in dataframe.columns}  
-
-    try:
-        df = dataframe.astype(dtype_dict)\
-                      .set_index(idx_cols)\
-                      .sort_index()
-        return df
-    except KeyError as e:
-        logger.log(level=1, msg=e)
+    Parameters
+    ==========
+    import_df: pd.DataFrame
+        Import dataframe, indexed (or with columns) by the unique columns.
+    mode: str
+        'range' bounds each key column (see `key_criterion`); 'values' joins
+        the exact import keys as a `VALUES` list, which suits small, sparse
+        imports.
+    """
+    if import_df.empty:
+        return pd.DataFrame()
+    if mode == 'values':
+        result = models.session.execute(values_select(import_df, db_table))
+        return rows_to_dataframe(result.fetchall(), list(result.keys()),
+                                 db_table, drop_last_modified=drop_last_modified)
+    elif mode != 'range':
+        raise ValueError(f"Unknown mode {mode!r}; use 'range' or 'values'.")
+    return filter_frame(db_table, key_criterion(import_df, db_table),
+                        drop_last_modified=drop_last_modified, cached=False)
+
+def _hashable(frame: pd.DataFrame) -> pd.DataFrame:
+    """Cast columns to canonical dtypes so that equal values hash equally.
+
+    Numeric columns (including `Decimal` object columns and nullable integer
+    types) become float64 with a single NaN and zero representation, which
+    matches the float conversion done by `collection_to_dataframe`. Dates
+    and datetimes (python objects or timezone-aware values) become naive
+    UTC `datetime64[ns]`.
+    """
+    columns = {}
+    for col, series in frame.items():
+        if series.dtype == object:
+            first = series.dropna().head(1)
+            if len(first) and isinstance(first.iloc[0], (dt.date, pd.Timestamp)):
+                series = pd.to_datetime(series, utc=True)
+            else:
+                try:
+                    series = pd.to_numeric(series)
+                except (TypeError, ValueError):
+                    pass
+        if pd.api.types.is_datetime64tz_dtype(series):
+            series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+        if pd.api.types.is_bool_dtype(series) \
+                or pd.api.types.is_numeric_dtype(series):
+            series = series.astype('float64') + 0.0
+            series = series.where(series.notna(), np.nan)
+        columns[col] = series
+    return pd.DataFrame(columns, index=frame.index)
+
+def key_ordered(dataframe: pd.DataFrame, idx_cols: list) -> pd.DataFrame:
+    """`dataframe` with its index levels in `idx_cols` order.
+
+    Keys are hashed by level position, so frames indexed by the same
+    columns in a different order must be aligned before matching.
+    """
+    names = list(dataframe.index.names)
+    if names == list(idx_cols):
         return dataframe
+    if sorted(n for n in names if n is not None) != sorted(idx_cols) \
+            or len(names) != len(idx_cols):
+        raise ValueError(f"Dataframe is indexed by {names}, expected the "
+                         f"unique columns {list(idx_cols)}.")
+    return dataframe.reorder_levels(idx_cols)
+
+def key_frame(index: pd.Index) -> pd.DataFrame:
+    """The unique key index as columns of canonical dtypes (see `_hashable`)."""
+    return _hashable(index.to_frame(index=False))
+
+def key_hashes(index: pd.Index) -> np.ndarray:
+    """Return a uint64 hash per row of the unique key index."""
+    return pd.util.hash_pandas_object(key_frame(index), index=False).to_numpy()
+
+def row_digests(dataframe: pd.DataFrame, value_cols: list) -> np.ndarray:
+    """Return a uint64 digest per row of the `value_cols` columns."""
+    if not value_cols:
+        return np.zeros(len(dataframe), dtype=np.uint64)
+    values = _hashable(dataframe.reindex(columns=value_cols))
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+def _record_chunks(db_records, db_table):
+    """Yield existing records as dataframes indexed by the unique columns.
+
+    `db_records` may be a list of database objects, a dataframe, or an
+    iterator of either (e.g. `iter_frames`).
+    """
+    if isinstance(db_records, pd.DataFrame):
+        yield db_records
+    elif isinstance(db_records, (list, tuple)):
+        yield collection_to_dataframe(db_records, db_table)
+    else:
+        for chunk in db_records:
+            if not isinstance(chunk, pd.DataFrame):
+                chunk = collection_to_dataframe(chunk, db_table)
+            yield chunk
 
+@metrics.timed
 def compare_to_db(import_df: pd.DataFrame, db_records: list, db_table,
                   insert_only: bool = False, ignore_nulls=False, 
                   debug=False)->(list, list):
@@ -132,10 +444,21 @@ def compare_to_db(import_df: pd.DataFrame, db_records: list, db_table,
     Takes the new and/or calculated values and compares them to the current database model.
     Returns insert database objects to be imported and update objects to alter the database.
 
+    Rows are matched on a hash of the unique key columns, confirmed by
+    comparing the key columns of the matched rows, and compared on a digest
+    of their value columns. Existing records are consumed one chunk at a
+    time.
+
     Parameters
     ==========
     import_df: pd.DataFrame 
-    db_records: sqlalchemy.ext.declarative.api.DeclarativeMeta 
+    db_records: list, pd.DataFrame or iterator
+        Existing records, either as database objects or as a dataframe
+        indexed by the unique key columns (see `collection_to_dataframe`), or
+        an iterator of such chunks (see `iter_frames`) for bounded memory.
+        When `None`, only the records within the import's key bounds are
+        fetched (see `existing_frame`).
+    db_table: sqlalchemy.ext.declarative.api.DeclarativeMeta 
         SQLAlchemy Object Relation Model that will be used as the mapper.
 
     Returns
@@ -146,8 +469,6 @@ def compare_to_db(import_df: pd.DataFrame, db_records: list, db_table,
     update_objects list(dict): 
         Dictionary of mapping objects to be passed into session.bulk_update_mappings() method.
     """
-    # Convert database records to dataframe with unique key columns as index.
-
     insert_objects, update_objects = [], []
     if import_df.empty:
         return insert_objects, update_objects
@@ -157,13 +478,12 @@ def compare_to_db(import_df: pd.DataFrame, db_records: list, db_table,
     if debug:
         print(idx_cols)
 
-    db = collection_to_dataframe(db_records, db_table)
-    if debug:
-        print("Database Records:", db.shape)
-    # Set index of importing dataframe to match database for comparision.
-    # TODO: see if the following function replace previously used commented function
-    im = import_df.loc[import_df.index.drop_duplicates()] \
-                  .drop(columns=prmy_keys, errors='ignore')
+    if db_records is None:
+        db_records = existing_frame(import_df, db_table)
+
+    im = key_ordered(import_df, idx_cols)
+    im = im[~im.index.duplicated()] \
+            .drop(columns=prmy_keys, errors='ignore')
     if not ignore_nulls:
         im = im.dropna()
 
@@ -173,71 +493,235 @@ def compare_to_db(import_df: pd.DataFrame, db_records: list, db_table,
     if im.empty:
         return insert_objects, update_objects
 
-    # If there are not previous database records, then return the insert objects 
-    # as the entire import dataframe converted to records.
-    if db.empty:
-        insert_objects = im.reset_index().to_dict(orient="records")
-    else:
-        diff_idx = im.compare(db.reindex_like(im)).index
-        insert_idx = diff_idx[~diff_idx.isin(db.index)]
-        insert_objects = im.loc[insert_idx] \
-                           .reset_index() \
-                           .to_dict(orient="records")
-        if insert_only:
-            return insert_objects, []
-
-        update_idx = diff_idx[diff_idx.isin(db.index)]
-        update_objects = im.loc[update_idx]
-        update_objects['id'] = db.loc[update_idx,'id']
-        update_objects = update_objects.reset_index() \
-                                       .to_dict(orient="records")
+    # Match existing records chunk by chunk against the hashed import keys,
+    # keeping only per-import-row state between chunks.
+    value_cols = list(im.columns)
+    im_key_frame = key_frame(im.index)
+    im_keys = pd.Index(pd.util.hash_pandas_object(im_key_frame, index=False)
+                         .to_numpy())
+    if not im_keys.is_unique:
+        raise ValueError(f"{table_object.name}: import keys collide on their "
+                         f"64-bit hash; load them in smaller batches.")
+    im_digests = row_digests(im, value_cols)
+    exists = np.zeros(len(im), dtype=bool)
+    changed = np.zeros(len(im), dtype=bool)
+    db_keys = {col: np.empty(len(im), dtype=object) 
+               for col in prmy_keys if col not in idx_cols}
+
+    db_rows = 0
+    for db in _record_chunks(db_records, db_table):
+        db_rows += len(db)
+        if db.empty:
+            continue
+        db = key_ordered(db, idx_cols)
+        db = db[~db.index.duplicated()]
+        db_key_frame = key_frame(db.index)
+        at = im_keys.get_indexer(
+            pd.util.hash_pandas_object(db_key_frame, index=False).to_numpy())
+        hit = at >= 0
+        # A hash match is only a match if the keys themselves are equal.
+        for col in idx_cols:
+            matched = np.flatnonzero(hit)
+            hit[matched] = im_key_frame[col].to_numpy()[at[matched]] \
+                           == db_key_frame[col].to_numpy()[matched]
+        if not hit.any():
+            continue
+        rows = at[hit]
+        exists[rows] = True
+        changed[rows] = im_digests[rows] != row_digests(db[hit], value_cols)
+        for col, keys in db_keys.items():
+            keys[rows] = db[col].to_numpy()[hit]
+    if debug:
+        print("Database Records:", db_rows)
+
+    # Import rows without a matching database record are inserts.
+    insert_objects = im[~exists].reset_index().to_dict(orient="records")
+    if insert_only:
+        return insert_objects, []
+
+    update_mask = exists & changed
+    update_df = im[update_mask].copy()
+    for col, keys in db_keys.items():
+        update_df[col] = keys[update_mask]
+    update_objects = update_df.reset_index().to_dict(orient="records")
 
     return insert_objects, update_objects
 
 
+# Adaptive batching: batch sizes move toward `batch_target_seconds` per
+# commit, within `[batch_min_size, batch_max_size]`.
+batch_target_seconds = 1.0
+batch_min_size = 10
+batch_max_size = 50000
+
+def _write_batch(write, batch: list, rejected: list, max_rejected: int) -> int:
+    """Write `batch` in a savepoint, bisecting it if it fails.
+
+    Rows that still fail on their own are appended to `rejected` as
+    `(mapping, error)` pairs. With a `max_rejected` limit, raises
+    `ValueError` as soon as more rows are rejected, so a systematic failure
+    stops after a bounded number of savepoints. Returns the number of rows
+    written.
+    """
+    try:
+        with models.session.begin_nested():
+            write(batch)
+        return len(batch)
+    except (exc.IntegrityError, exc.DataError) as e:
+        if len(batch) == 1:
+            rejected.append((batch[0], repr(e.orig)))
+            if max_rejected is not None and len(rejected) > max_rejected:
+                raise ValueError(f"More than {max_rejected} rows rejected; "
+                                 f"last: {rejected[-1][1]}") from e
+            return 0
+    middle = len(batch) // 2
+    return _write_batch(write, batch[:middle], rejected, max_rejected) \
+           + _write_batch(write, batch[middle:], rejected, max_rejected)
+
+def write_batches(objects: list, write, table_name: str, kind: str,
+                  batch_size: int, target_seconds: float = None,
+                  rejected: list = None, max_rejected: int = None,
+                  debug: bool = False) -> int:
+    """Write `objects` with `write(batch)`, committing each batch.
+
+    After every commit the batch size is scaled toward `target_seconds` per
+    batch (at most halved or doubled at a time).
+
+    A batch that fails with an integrity or data error is bisected in
+    savepoints down to the offending rows, which are skipped and appended to
+    `rejected` instead of aborting the load. With a `max_rejected` limit the
+    load aborts with `ValueError` once more rows (counted across the whole
+    `rejected` list) have been rejected; `max_rejected=0` is strict mode, in
+    which a failing batch raises its database error without any savepoints.
+    Batches committed before an error stay committed.
+
+    Returns the number of rows written.
+    """
+    if target_seconds is None:
+        target_seconds = batch_target_seconds
+    if rejected is None:
+        rejected = []
+    failures = len(rejected)
+    written = 0
+    position = 0
+    start = time.perf_counter()
+    with tqdm(total=len(objects), position=2, desc=f"{kind.title()} Objects",
+              leave=False) as progress:
+        while position < len(objects):
+            batch = objects[position: position + batch_size]
+            if debug:
+                print(f"{kind.title()} {len(batch)} records.")
+            batch_start = time.perf_counter()
+            with metrics.registry.timer('batch', f"{table_name}.{kind}") as m:
+                try:
+                    if max_rejected == 0:
+                        write(batch)
+                        rows = len(batch)
+                    else:
+                        rows = _write_batch(write, batch, rejected, max_rejected)
+                    models.session.commit()
+                except Exception:
+                    models.session.rollback()
+                    logger.error(f"{table_name}: {kind} aborted after {written} "
+                                 f"rows, {len(rejected) - failures} rejected.")
+                    raise
+                m['rows'] = rows
+            seconds = time.perf_counter() - batch_start
+            written += rows
+            position += len(batch)
+            progress.update(len(batch))
+            scale = min(max(target_seconds / max(seconds, 1e-6), 0.5), 2.0)
+            batch_size = int(min(max(batch_size * scale, batch_min_size),
+                                 batch_max_size))
+
+    seconds = time.perf_counter() - start
+    if len(rejected) > failures:
+        logger.warning(f"{table_name}: {len(rejected) - failures} rows rejected "
+                       f"while writing {kind}.")
+    logger.info(f"{table_name}: {written} rows {kind} in {seconds:.2f}s "
+                f"({written / max(seconds, 1e-6):,.0f} rows/s).")
+    return written
+
+@metrics.timed
+def load_objects(insert_objects: list, update_objects: list, db_table,
+                 debug: bool = False, target_seconds: float = None,
+                 rejected: list = None, max_rejected: int = None)->(int, int):
+    """Write `compare_to_db` mappings in adaptively sized, committed batches.
+
+    Uses the calling thread's session. Rows rejected by the database are
+    skipped and, when `rejected` is given, appended to it as
+    `(mapping, error)` pairs; `max_rejected` bounds how many may be skipped,
+    and `max_rejected=0` raises on the first (see `write_batches`). Returns
+    the number of inserted and updated records.
+    """
+    table_name = db_table.__table__.name
+    if debug:
+        print(f"Inserting {len(insert_objects)} and updating {len(update_objects)}")
+    inserted = updated = 0
+    if insert_objects:
+        inserted = write_batches(
+            insert_objects,
+            lambda batch: models.session.bulk_insert_mappings(db_table, batch),
+            table_name, 'insert', 1000, target_seconds=target_seconds,
+            rejected=rejected, max_rejected=max_rejected, debug=debug)
+    if update_objects:
+        updated = write_batches(
+            update_objects,
+            lambda batch: models.session.bulk_update_mappings(db_table, batch),
+            table_name, 'update', 100, target_seconds=target_seconds,
+            rejected=rejected, max_rejected=max_rejected, debug=debug)
+    if inserted or updated:
+        cache.invalidate(table_name)
+    return inserted, updated
+
+@metrics.timed
 def update_database_object(import_df, db_records, db_table, debug: bool = False,
-                           insert_only: bool = False, refresh_object=None):
+                           insert_only: bool = False, refresh_object=None,
+                           method: str = 'bulk', rejected: list = None,
+                           max_rejected: int = None):
     """Export items to database as insert or update statements.
     
     This function uses the return from `compare_to_db(import_df=import_df, 
                                                       db_records=db_records, 
                                                       db_table=db_table)`
     to update the database with new records and records that need updating (rare and would only be the result of a reconfiguring of the pull process).
+    `db_records` may be an `iter_frames` chunk iterator, which keeps a
+    full-table reconcile in bounded memory, or `None` to fetch only the
+    records the import can touch (`existing_frame`).
+
+    With `method='copy'` the import dataframe is instead streamed into a
+    staging table and upserted on the server (see `loader.copy_upsert`);
+    `db_records` is not used and may be `None`.
+
+    With `method='bulk'`, rows the database rejects are isolated and
+    skipped, and appended to `rejected` (when given) as `(mapping, error)`
+    pairs. The load aborts with `ValueError` once more than `max_rejected`
+    rows are rejected; `max_rejected=0` raises on the first bad row. `copy`
+    loads are all or nothing.
     
     ** NOTE: All New datarows must be free of 'Null' values or they will be 
     dropped upon insertion.**
     """
+    if method == 'copy':
+        inserted, updated = loader.copy_upsert(import_df, db_table,
+                                               insert_only=insert_only,
+                                               debug=debug)
+        if (inserted or updated) and refresh_object:
+            models.session.refresh(refresh_object)
+        return refresh_object
+    elif method != 'bulk':
+        raise ValueError(f"Unknown load method {method!r}; use 'bulk' or 'copy'.")
+
     insert_objects, update_objects = compare_to_db(import_df=import_df, 
                                                    db_records=db_records, 
                                                    db_table=db_table,
                                                    insert_only=insert_only,
                                                    debug=debug)
-    if debug:
-        print(f"Inserting {len(insert_objects)} and updating {len(update_objects)}")
-    if insert_objects:
-        for i in tqdm(iterable=range(0, len(insert_objects) // 1000 + 1),
-                        position=2,
-                        desc=f"Inserting Objects",
-                        leave=False):
-            objects_slice = insert_objects[1000 * i: 1000 * (i + 1)]
-            if debug:
-                print(f"Inserting {len(objects_slice)} records.")
-            session.bulk_insert_mappings(db_table, objects_slice)
-            session.commit()
-
-    if update_objects:
-        for i in tqdm(iterable=range(0, len(update_objects) // 100 + 1),
-                        position=2,
-                        desc=f"Updating Objects",
-                        leave=False):
-            objects_slice = update_objects[100 * i: 100 * (i + 1)]
-            if debug:
-                print(f"Updating {len(objects_slice)} records.")
-            session.bulk_update_mappings(db_table, objects_slice)
-            session.commit()
+    load_objects(insert_objects, update_objects, db_table, debug=debug,
+                 rejected=rejected, max_rejected=max_rejected)
     if (insert_objects or update_objects) and refresh_object:
         #TODO Refer to prices.price() procedure for session.refresh(asset) method.
-        session.refresh(refresh_object)
+        models.session.refresh(refresh_object)
         return refresh_object
 
     return refresh_object
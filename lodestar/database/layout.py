@@ -0,0 +1,395 @@
+"""Physical layout of the history tables: partitioning, indexes and stats.
+
+`price_history`, `tidemark_history` and `tidemark_history_daily` are read by
+`(asset_id, date)` ranges and grow by date. `migrate` rebuilds one of them as
+a declaratively range-partitioned table on `date` (yearly or monthly
+partitions plus a default partition) in a single transaction. The primary
+key becomes `(id, date)`, because a partitioned table's unique constraints
+must contain the partition key; the `UniqueConstraint`s already do.
+The automapped model keeps the same class and columns. Only the partitioned
+parent is reflected (`models.tables`), so queries go through the parent and
+are pruned to the partitions covering their dates.
+
+Methods
+-------
+migrate(db_table, interval='year')->bool
+    Convert a table to range partitions by date.
+
+ensure_partitions(db_table, through)
+    Create the partitions needed up to a date.
+
+create_indexes(db_table)->list
+    B-tree indexes for each `UniqueConstraint` and a BRIN index on `date`.
+
+analyze(db_table, min_changes=1)->list
+    `ANALYZE` only the partitions modified since they were last analyzed.
+
+explain(db_table)->dict, report(before, after)->pandas.DataFrame
+    Plans of the standard reads and a before/after comparison.
+"""
+import datetime as dt
+import pandas as pd
+from sqlalchemy import text, and_, UniqueConstraint
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Executable, ClauseElement
+from . import get_engine, schema
+from . import models
+from . import functions
+from .snapshots import latest_statement
+from .. import logger
+
+partition_key = 'date'
+
+def _qualified(name: str) -> str:
+    return f"{schema}.{name}"
+
+def _scalar(conn, sql: str, **params):
+    return conn.execute(text(sql), params).scalar()
+
+def is_partitioned(conn, table_name: str) -> bool:
+    return _scalar(conn, "SELECT relkind = 'p' FROM pg_class "
+                         "WHERE oid = CAST(:t AS regclass)",
+                   t=_qualified(table_name))
+
+## PARTITIONS
+def partition_bounds(start: dt.date, end: dt.date, interval: str = 'year'):
+    """`(suffix, lower, upper)` of the partitions covering `[start, end]`."""
+    if interval not in ('year', 'month'):
+        raise ValueError(f"interval must be 'year' or 'month', not {interval!r}")
+    bounds = []
+    if interval == 'year':
+        for year in range(start.year, end.year + 1):
+            bounds.append((f"y{year}", dt.date(year, 1, 1), dt.date(year + 1, 1, 1)))
+        return bounds
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        upper = dt.date(year + month // 12, month % 12 + 1, 1)
+        bounds.append((f"m{year}{month:02d}", dt.date(year, month, 1), upper))
+        year, month = upper.year, upper.month
+    return bounds
+
+def _create_partitions(conn, table_name: str, parent: str, bounds: list):
+    for suffix, lower, upper in bounds:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {_qualified(table_name)}_{suffix} "
+            f"PARTITION OF {_qualified(parent)} "
+            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"))
+
+def ensure_partitions(db_table, through: dt.date = None, interval: str = 'year',
+                      ahead: int = 1):
+    """Create the partitions of `db_table` up to `through`.
+
+    Defaults to `ahead` intervals past today. Rows already in the default
+    partition for a new range must be moved out before it can be created.
+    """
+    table_name = db_table.__table__.name
+    today = dt.date.today()
+    if through is None:
+        through = dt.date(today.year + ahead, 12, 31) if interval == 'year' \
+                  else (pd.Timestamp(today) + pd.DateOffset(months=ahead)).date()
+    with get_engine().begin() as conn:
+        _create_partitions(conn, table_name, table_name,
+                           partition_bounds(today, through, interval))
+
+def migrate(db_table, interval: str = 'year', ahead: int = 1,
+            debug: bool = False) -> bool:
+    """Rebuild `db_table` as a table range-partitioned by `date`.
+
+    The rows are copied into a new partitioned table, which then takes the
+    old table's name, primary key (extended with `date`), unique, foreign
+    key and trigger definitions, other indexes, owner, privileges and serial
+    sequences, all in one transaction. Tables referenced by foreign keys or
+    used by views are refused before any row is copied.
+
+    Returns
+    =======
+    bool
+        False if the table was already partitioned.
+    """
+    table_object, _, primary_keys = functions.get_unique_cols(db_table=db_table)
+    name = table_object.name
+    qualified = _qualified(name)
+    staging = f"{name}__partitioned"
+    unique_constraints = [[c.name for c in constraint.columns]
+                          for constraint in table_object.constraints
+                          if type(constraint) is UniqueConstraint]
+
+    with get_engine().begin() as conn:
+        if is_partitioned(conn, name):
+            logger.info(f"{qualified} is already partitioned.")
+            return False
+        oid = {'t': qualified}
+        referencing = conn.execute(text(
+            "SELECT conname, conrelid::regclass::text FROM pg_constraint "
+            "WHERE contype = 'f' AND confrelid = CAST(:t AS regclass)"), oid).all()
+        if referencing:
+            raise ValueError(f"{qualified} is referenced by foreign keys "
+                             f"{referencing}; they need a unique `id`, which a "
+                             f"table partitioned by date cannot provide.")
+        views = conn.execute(text(
+            "SELECT DISTINCT r.ev_class::regclass::text FROM pg_depend d "
+            "JOIN pg_rewrite r ON r.oid = d.objid "
+            "WHERE d.classid = 'pg_rewrite'::regclass "
+            "AND d.refobjid = CAST(:t AS regclass) "
+            "AND r.ev_class <> d.refobjid"), oid).scalars().all()
+        if views:
+            raise ValueError(f"{qualified} is used by views {views}; drop them "
+                             f"before migrating and recreate them afterwards.")
+        owner = _scalar(conn, "SELECT quote_ident(pg_get_userbyid(relowner)) "
+                              "FROM pg_class "
+                              "WHERE oid = CAST(:t AS regclass)", **oid)
+        grants = conn.execute(text(
+            "SELECT CASE WHEN a.grantee = 0 THEN 'PUBLIC' "
+            "ELSE quote_ident(pg_get_userbyid(a.grantee)) END, "
+            "a.privilege_type, a.is_grantable "
+            "FROM pg_class c, aclexplode(c.relacl) a "
+            "WHERE c.oid = CAST(:t AS regclass) AND a.grantee <> c.relowner"),
+            oid).all()
+        foreign_keys = conn.execute(text(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE contype = 'f' AND conrelid = CAST(:t AS regclass)"), oid).all()
+        triggers = conn.execute(text(
+            "SELECT pg_get_triggerdef(oid) FROM pg_trigger "
+            "WHERE tgrelid = CAST(:t AS regclass) AND NOT tgisinternal"), oid).all()
+        indexes = conn.execute(text(
+            "SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i "
+            "WHERE i.indrelid = CAST(:t AS regclass) AND NOT EXISTS ("
+            "SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)"),
+            oid).all()
+        sequences = [(column.name, sequence) for column in table_object.columns
+                     for sequence in [_scalar(conn, "SELECT pg_get_serial_sequence"
+                                                    "(:t, :c)", t=qualified,
+                                              c=column.name)]
+                     if sequence]
+        start, end, count = conn.execute(text(
+            f"SELECT min({partition_key}), max({partition_key}), count(*) "
+            f"FROM {qualified}")).one()
+        today = dt.date.today()
+        start = start or today
+        end = max(end or today, today)
+        end = dt.date(end.year + ahead, 12, 31) if interval == 'year' \
+              else (pd.Timestamp(end) + pd.DateOffset(months=ahead)).date()
+
+        if debug:
+            print(f"Partitioning {count} rows of {qualified} by {interval}.")
+        conn.execute(text(
+            f"CREATE TABLE {_qualified(staging)} (LIKE {qualified} "
+            f"INCLUDING DEFAULTS INCLUDING STORAGE INCLUDING COMMENTS) "
+            f"PARTITION BY RANGE ({partition_key})"))
+        _create_partitions(conn, name, staging,
+                           partition_bounds(start, end, interval))
+        conn.execute(text(f"CREATE TABLE {qualified}_default "
+                          f"PARTITION OF {_qualified(staging)} DEFAULT"))
+        columns = ', '.join(c.name for c in table_object.columns)
+        conn.execute(text(f"INSERT INTO {_qualified(staging)} ({columns}) "
+                          f"SELECT {columns} FROM {qualified}"))
+        copied = _scalar(conn, f"SELECT count(*) FROM {_qualified(staging)}")
+        if copied != count:
+            raise RuntimeError(f"Copied {copied} of {count} rows of {qualified}.")
+
+        for _, sequence in sequences:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+        conn.execute(text(f"DROP TABLE {qualified}"))
+        conn.execute(text(f"ALTER TABLE {_qualified(staging)} RENAME TO {name}"))
+
+        key = primary_keys + [partition_key] if partition_key not in primary_keys \
+              else primary_keys
+        conn.execute(text(f"ALTER TABLE {qualified} ADD CONSTRAINT {name}_pkey "
+                          f"PRIMARY KEY ({', '.join(key)})"))
+        for unique_cols in unique_constraints:
+            conn.execute(text(
+                f"ALTER TABLE {qualified} ADD CONSTRAINT "
+                f"{name}_{'_'.join(unique_cols)}_key UNIQUE ({', '.join(unique_cols)})"))
+        for constraint_name, definition in foreign_keys:
+            conn.execute(text(f"ALTER TABLE {qualified} ADD CONSTRAINT "
+                              f"{constraint_name} {definition}"))
+        for definition, in indexes + triggers:
+            try:
+                with conn.begin_nested():
+                    conn.execute(text(definition))
+            except ProgrammingError as e:
+                logger.warning(f"Not recreated on {qualified}: {definition} ({e.orig})")
+        if owner != _scalar(conn, "SELECT quote_ident(current_user)"):
+            conn.execute(text(f"ALTER TABLE {qualified} OWNER TO {owner}"))
+        for grantee, privilege, grantable in grants:
+            conn.execute(text(f"GRANT {privilege} ON {qualified} TO {grantee}"
+                              + (" WITH GRANT OPTION" if grantable else "")))
+        for column_name, sequence in sequences:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} "
+                              f"OWNED BY {qualified}.{column_name}"))
+
+    # The primary key changed; reflect it again on the next `prepare()`.
+    models.clear_schema_cache()
+    logger.info(f"Partitioned {count} rows of {qualified} by {interval}.")
+    return True
+
+## INDEXES
+def create_indexes(db_table, brin: bool = True,
+                   pages_per_range: int = 32) -> list:
+    """Index `db_table` for the `(asset_id, date)` range reads.
+
+    Makes sure every reflected `UniqueConstraint` has a B-tree index with the
+    same leading columns, and adds a BRIN index on `date`, which stays
+    tiny because rows arrive roughly in date order. On a partitioned table
+    the indexes are created on every partition.
+
+    Returns the names of the indexes created.
+    """
+    table_object = db_table.__table__
+    name = table_object.name
+    qualified = _qualified(name)
+    created = []
+    with get_engine().begin() as conn:
+        existing = [tuple(row[0]) for row in conn.execute(text(
+            "SELECT array(SELECT a.attname FROM unnest(i.indkey) WITH ORDINALITY "
+            "AS k(attnum, n) JOIN pg_attribute a ON a.attrelid = i.indrelid "
+            "AND a.attnum = k.attnum ORDER BY k.n) "
+            "FROM pg_index i WHERE i.indrelid = CAST(:t AS regclass)"),
+            {'t': qualified})]
+        for constraint in table_object.constraints:
+            if type(constraint) is not UniqueConstraint:
+                continue
+            columns = tuple(c.name for c in constraint.columns)
+            if any(index[:len(columns)] == columns for index in existing):
+                continue
+            index_name = f"{name}_{'_'.join(columns)}_idx"
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index_name} "
+                              f"ON {qualified} ({', '.join(columns)})"))
+            created.append(index_name)
+        if brin:
+            index_name = f"{name}_{partition_key}_brin"
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS {index_name} ON {qualified} "
+                f"USING brin ({partition_key}) "
+                f"WITH (pages_per_range = {int(pages_per_range)})"))
+            created.append(index_name)
+    return created
+
+## STATISTICS
+def analyze(db_table, min_changes: int = 1, include_parent: bool = None) -> list:
+    """Partition-aware `ANALYZE` of `db_table`.
+
+    Only partitions with at least `min_changes` rows modified since their
+    last analyze (or never analyzed) are analyzed. Autovacuum never analyzes
+    partitioned parents, so the parent's own statistics are refreshed too
+    when any partition changed (or always with `include_parent=True`,
+    never with `include_parent=False`). PostgreSQL 18+ does this with
+    `ANALYZE ONLY`. Older servers have no `ONLY` form, so a plain parent
+    `ANALYZE` is run instead, which also covers every partition.
+
+    Returns the names of the tables analyzed.
+    """
+    name = db_table.__table__.name
+    qualified = _qualified(name)
+    with get_engine().begin() as conn:
+        if not is_partitioned(conn, name):
+            conn.execute(text(f"ANALYZE {qualified}"))
+            return [name]
+        partitions = conn.execute(text(
+            "SELECT c.relname, coalesce(s.n_mod_since_analyze, 0), "
+            "coalesce(s.last_analyze, s.last_autoanalyze) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid "
+            "WHERE i.inhparent = CAST(:t AS regclass) ORDER BY c.relname"),
+            {'t': qualified}).all()
+        changed = [partition for partition, changes, last_analyzed in partitions
+                   if changes >= min_changes or last_analyzed is None]
+        if include_parent is None:
+            include_parent = bool(changed)
+        version = int(_scalar(conn, "SHOW server_version_num"))
+        if version >= 180000 or not include_parent:
+            for partition in changed:
+                conn.execute(text(f"ANALYZE {_qualified(partition)}"))
+            if include_parent:
+                conn.execute(text(f"ANALYZE ONLY {qualified}"))
+        else:
+            conn.execute(text(f"ANALYZE {qualified}"))
+        analyzed = changed + ([name] if include_parent else [])
+    logger.info(f"Analyzed {len(analyzed)} of {len(partitions)} partitions "
+                f"of {qualified}.")
+    return analyzed
+
+## PLANS
+def standard_queries(db_table) -> dict:
+    """The reads `filter_query`, `existing_frame` and snapshots issue.
+
+    Parameters are taken from the table itself: its first asset and the
+    last year of that asset's dates.
+    """
+    table = db_table.__table__
+    with get_engine().connect() as conn:
+        asset_id, end = conn.execute(text(
+            f"SELECT asset_id, max({partition_key}) FROM {_qualified(table.name)} "
+            f"GROUP BY asset_id ORDER BY asset_id LIMIT 1")).one()
+    start = end - dt.timedelta(days=365)
+    asset_range = [db_table.asset_id == asset_id, db_table.date >= start,
+                   db_table.date <= end]
+    queries = {
+        'asset_range': functions.select_table(db_table, asset_range),
+        'date_cross_section': functions.select_table(db_table,
+                                                     [db_table.date == end]),
+        'reconcile_range': functions.select_table(
+            db_table, [db_table.asset_id.in_(range(asset_id, asset_id + 50)),
+                       and_(db_table.date >= start, db_table.date <= end)]),
+    }
+    if 'tidemark_id' not in table.c:
+        queries['latest'] = latest_statement(db_table, as_of=end)
+    return queries
+
+def _plan_nodes(plan: dict) -> list:
+    nodes = [plan['Node Type'] + (f" on {plan['Relation Name']}"
+                                  if 'Relation Name' in plan else '')]
+    for child in plan.get('Plans', []):
+        nodes += _plan_nodes(child)
+    return nodes
+
+class Explain(Executable, ClauseElement):
+    """`EXPLAIN (<options> FORMAT JSON) <statement>`, bound like the statement."""
+    inherit_cache = False
+
+    def __init__(self, statement, options: str = ''):
+        self.statement = statement
+        self.options = options
+
+@compiles(Explain, 'postgresql')
+def _compile_explain(element, compiler, **kw):
+    return (f"EXPLAIN ({element.options}FORMAT JSON) "
+            f"{compiler.process(element.statement, **kw)}")
+
+def explain(db_table, queries: dict = None, analyze: bool = True) -> dict:
+    """`EXPLAIN` each of `queries` (default `standard_queries`).
+
+    Returns `{name: plan}` with the JSON plan of each query.
+    """
+    queries = standard_queries(db_table) if queries is None else queries
+    options = 'ANALYZE, BUFFERS, ' if analyze else ''
+    plans = {}
+    with get_engine().connect() as conn:
+        for name, statement in queries.items():
+            plans[name] = conn.execute(Explain(statement, options)).scalar()[0]
+    return plans
+
+def report(before: dict, after: dict) -> pd.DataFrame:
+    """Compare two `explain` results query by query.
+
+    Returns
+    =======
+    pandas.DataFrame
+        Per query: estimated cost, execution time (with `analyze`), number
+        of relations scanned and the plan nodes, before and after.
+    """
+    rows = []
+    for name in before:
+        row = {'query': name}
+        for label, plans in (('before', before), ('after', after)):
+            plan = plans.get(name)
+            if plan is None:
+                continue
+            nodes = _plan_nodes(plan['Plan'])
+            row[f"{label}_cost"] = plan['Plan']['Total Cost']
+            row[f"{label}_ms"] = plan.get('Execution Time')
+            row[f"{label}_relations"] = sum(' on ' in n for n in nodes)
+            row[f"{label}_plan"] = ' > '.join(nodes)
+        rows.append(row)
+    return pd.DataFrame(rows).set_index('query')
@@ -0,0 +1,189 @@
+"""COPY-based bulk loading with a server-side upsert.
+
+The import dataframe is streamed into a temporary staging table with
+`COPY ... FROM STDIN` and merged into the target table with a single
+`INSERT ... ON CONFLICT (<unique cols>) DO UPDATE ... WHERE ... IS DISTINCT
+FROM ...` statement, all in one transaction. No existing records need to be
+read on the client.
+
+Methods
+-------
+copy_upsert(import_df, db_table)->int, int
+    Load a dataframe into `db_table`, returning inserted and updated counts.
+
+upsert_statement(table_object, columns, unique_cols)->str
+    The `INSERT ... ON CONFLICT` statement applied from the staging table.
+"""
+import io
+import pandas as pd
+from sqlalchemy import Integer
+from . import get_engine
+from . import functions
+from . import metrics
+from . import cache
+
+staging_table = 'lodestar_staging'
+null_string = r'\N'
+
+def _quote(name: str) -> str:
+    return get_engine().dialect.identifier_preparer.quote(name)
+
+def upsert_statement(table_object, columns: list, unique_cols: list,
+                     insert_only: bool = False,
+                     staging: str = staging_table,
+                     partitioned: bool = False) -> str:
+    """Return the upsert from `staging` into `table_object`.
+
+    The statement returns a single row with the inserted and updated counts.
+    Rows whose values are unchanged are not rewritten. When the table has a
+    `last_modified` column that is not being loaded, it is set to `now()` on
+    update.
+
+    Inserts are counted from `RETURNING (xmax = 0)`, which is true for rows
+    the statement inserted. Partitioned tables cannot return system columns;
+    with `partitioned=True` each returned key is instead looked up in the
+    pre-upsert snapshot of the table, which costs one extra index probe per
+    written row.
+    """
+    target = get_engine().dialect.identifier_preparer.format_table(table_object)
+    col_list = ", ".join(_quote(c) for c in columns)
+    value_cols = [c for c in columns if c not in unique_cols]
+
+    if insert_only or not value_cols:
+        conflict_action = "DO NOTHING"
+    else:
+        assignments = [f"{_quote(c)} = EXCLUDED.{_quote(c)}" for c in value_cols]
+        if 'last_modified' in table_object.c and 'last_modified' not in columns:
+            assignments.append(f"{_quote('last_modified')} = now()")
+        current = ", ".join(f"t.{_quote(c)}" for c in value_cols)
+        excluded = ", ".join(f"EXCLUDED.{_quote(c)}" for c in value_cols)
+        conflict_action = (f"DO UPDATE SET {', '.join(assignments)} "
+                           f"WHERE ({current}) IS DISTINCT FROM ({excluded})")
+
+    conflict = ", ".join(_quote(c) for c in unique_cols)
+    if not partitioned:
+        return f"""
+        WITH upserted AS (
+            INSERT INTO {target} AS t ({col_list})
+            SELECT {col_list} FROM {staging}
+            ON CONFLICT ({conflict})
+            {conflict_action}
+            RETURNING (t.xmax = 0) AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted),
+               count(*) FILTER (WHERE NOT inserted)
+        FROM upserted"""
+
+    # The outer query reads `target` in the snapshot taken before the upsert,
+    # so a returned key that already existed there was updated.
+    key_list = ", ".join(f"t.{_quote(c)}" for c in unique_cols)
+    key_match = " AND ".join(f"e.{_quote(c)} = u.{_quote(c)}" for c in unique_cols)
+    return f"""
+        WITH upserted AS (
+            INSERT INTO {target} AS t ({col_list})
+            SELECT {col_list} FROM {staging}
+            ON CONFLICT ({conflict})
+            {conflict_action}
+            RETURNING {key_list}
+        )
+        SELECT count(*) FILTER (WHERE NOT existed),
+               count(*) FILTER (WHERE existed)
+        FROM (SELECT EXISTS (SELECT 1 FROM {target} AS e WHERE {key_match})
+                     AS existed
+              FROM upserted AS u) AS probed"""
+
+def _load_frame(import_df: pd.DataFrame, table_object, unique_cols: list,
+                primary_keys: list, ignore_nulls: bool) -> pd.DataFrame:
+    """Flatten the import dataframe to the table columns that will be loaded."""
+    frame = import_df[~import_df.index.duplicated()]
+    if any(frame.index.names):
+        frame = frame.reset_index()
+    missing = [c for c in unique_cols if c not in frame.columns]
+    if missing:
+        raise ValueError(f"Import dataframe is missing unique columns {missing} "
+                         f"of {table_object.name}.")
+
+    # Surrogate primary keys are assigned by the database.
+    columns = [c.name for c in table_object.columns
+               if c.name in frame.columns
+               and (c.name in unique_cols or c.name not in primary_keys)]
+    frame = frame[columns]
+    if not ignore_nulls:
+        frame = frame.dropna()
+
+    # Integer columns often arrive as floats; COPY rejects '1.0' for integers.
+    for c in columns:
+        if isinstance(table_object.c[c].type, Integer) \
+                and pd.api.types.is_float_dtype(frame[c]):
+            frame = frame.assign(**{c: frame[c].astype('Int64')})
+    return frame
+
+@metrics.timed
+def copy_upsert(import_df: pd.DataFrame, db_table, insert_only: bool = False,
+                ignore_nulls: bool = False, debug: bool = False)->(int, int):
+    """Load `import_df` into `db_table` through a COPY staging table.
+
+    Parameters
+    ==========
+    import_df: pd.DataFrame
+        New values, indexed (or with columns) by the table's unique columns.
+    db_table: sqlalchemy.ext.declarative.api.DeclarativeMeta
+        SQLAlchemy Object Relation Model of the target table.
+    insert_only: bool
+        Leave existing rows untouched.
+    ignore_nulls: bool
+        Keep rows containing nulls (dropped by default, as in `compare_to_db`).
+
+    Returns
+    =======
+    inserted, updated: int
+        Number of rows inserted and updated.
+    """
+    table_object, unique_cols, primary_keys = functions.get_unique_cols(
+        db_table=db_table)
+    frame = _load_frame(import_df, table_object, unique_cols, primary_keys,
+                        ignore_nulls)
+    if frame.empty:
+        return 0, 0
+
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False, na_rep=null_string)
+    buffer.seek(0)
+
+    columns = list(frame.columns)
+    col_list = ", ".join(_quote(c) for c in columns)
+    target = get_engine().dialect.identifier_preparer.format_table(table_object)
+    if debug:
+        print(f"Copying {len(frame)} rows into {table_object.name}.")
+
+    connection = get_engine().raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass",
+                       (target,))
+        partitioned = cursor.fetchone()[0]
+        cursor.execute(f"CREATE TEMPORARY TABLE {staging_table} "
+                       f"ON COMMIT DROP AS SELECT {col_list} FROM {target} "
+                       f"WITH NO DATA")
+        with metrics.registry.timer('batch', f"{table_object.name}.copy") as m:
+            cursor.copy_expert(f"COPY {staging_table} ({col_list}) FROM STDIN "
+                               f"WITH (FORMAT csv, NULL '{null_string}')", buffer)
+            m['rows'] = len(frame)
+        with metrics.registry.timer('batch', f"{table_object.name}.upsert") as m:
+            cursor.execute(upsert_statement(table_object, columns, unique_cols,
+                                            insert_only=insert_only,
+                                            partitioned=partitioned))
+            inserted, updated = cursor.fetchone()
+            connection.commit()
+            m['rows'] = inserted + updated
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    if inserted or updated:
+        cache.invalidate(table_object.name)
+
+    if debug:
+        print(f"Inserted {inserted} and updated {updated} rows.")
+    return inserted, updated
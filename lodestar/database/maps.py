@@ -1,15 +1,415 @@
-from .models import Asset, Tidemark
-from .functions import all_query, collection_to_dataframe 
+"""Lookup maps between dimension ids and names.
 
-asset_map = {a.id: a for a in all_query(Asset)}
-tidemark_map = {tm.id:tm for tm in all_query(Tidemark)}
+Maps are built lazily, on first lookup, from a single `(id, name)` query per
+table and are held as sorted NumPy arrays with read-only dict views over
+them, so importing this module does not touch the database.
 
-tm_id_name_map = {
-    tm.id: tm.tidemark for tm in all_query(Tidemark)
+Maps
+----
+asset_map, asset_id_name_map : {asset id: ticker}
+asset_name_id_map : {ticker: asset id}
+tidemark_map, tm_id_name_map : {tidemark id: tidemark name}
+tm_name_id_map : {tidemark name: tidemark id}
+
+Resolution
+----------
+resolve(import_df, db_table, missing='raise')
+    Replace `asset`/`tidemark` name columns with their ids in bulk,
+    optionally inserting unknown names first.
+
+Invalidation
+------------
+refresh(table_name=None)
+    Reload a table's maps (or all of them) immediately.
+invalidate(table_name=None)
+    Drop a table's arrays so the next lookup reloads them.
+listen(channel)
+    Start a thread that invalidates maps on PostgreSQL `NOTIFY <channel>`,
+    with the table name as payload. `install_notify_triggers()` creates the
+    triggers that send these notifications.
+"""
+import select
+import threading
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+from sqlalchemy import select as sql_select, text, exc
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from . import get_engine, schema
+from . import models
+from . import functions
+from . import cache
+from .. import logger
+
+notify_channel = 'lodestar_maps'
+
+class _MapView(Mapping):
+    """Read-only dict view from one column of a `TableLookup` to the other."""
+    def __init__(self, lookup, by_name: bool = False):
+        self._lookup = lookup
+        self._by_name = by_name
+
+    def _arrays(self):
+        arrays = self._lookup.arrays
+        if self._by_name:
+            return arrays['names_sorted'], arrays['ids_by_name']
+        return arrays['ids'], arrays['names']
+
+    def _position(self, keys, key):
+        try:
+            i = np.searchsorted(keys, key)
+        except TypeError:
+            raise KeyError(key) from None
+        if i < len(keys) and keys[i] == key:
+            return i
+        raise KeyError(key)
+
+    def __getitem__(self, key):
+        keys, values = self._arrays()
+        value = values[self._position(keys, key)]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def __iter__(self):
+        return iter(self._arrays()[0].tolist())
+
+    def __len__(self):
+        return len(self._arrays()[0])
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    def lookup(self, keys, default=None) -> np.ndarray:
+        """Vectorized lookup of an array of keys.
+
+        Keys that are not in the map are returned as `default`.
+        """
+        map_keys, values = self._arrays()
+        keys = np.asarray(keys, dtype=map_keys.dtype)
+        if not len(map_keys):
+            return np.full(len(keys), default, dtype=object)
+        pos = np.searchsorted(map_keys, keys).clip(0, len(map_keys) - 1)
+        found = map_keys[pos] == keys
+        if found.all():
+            return values[pos]
+        result = values[pos].astype(object)
+        result[~found] = default
+        return result
+
+class TableLookup:
+    """Compact id/name arrays for one dimension table, loaded on demand."""
+    def __init__(self, model_name: str, name_col: str, id_col: str = 'id'):
+        self.model_name = model_name
+        self.name_col = name_col
+        self.id_col = id_col
+        self._arrays = None
+        self._lock = threading.RLock()
+        self.id_name_map = _MapView(self)
+        self.name_id_map = _MapView(self, by_name=True)
+
+    @property
+    def table(self):
+        return getattr(models, self.model_name).__table__
+
+    @property
+    def arrays(self) -> dict:
+        arrays = self._arrays
+        if arrays is None:
+            with self._lock:
+                if self._arrays is None:
+                    self._arrays = self._load()
+                arrays = self._arrays
+        return arrays
+
+    def _load(self) -> dict:
+        table = self.table
+        id_col, name_col = table.c[self.id_col], table.c[self.name_col]
+        with get_engine().connect() as conn:
+            rows = conn.execute(
+                sql_select(id_col, name_col).order_by(id_col)).all()
+        ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        names = np.empty(len(rows), dtype=object)
+        names[:] = [r[1] for r in rows]
+
+        named = np.array([n is not None for n in names], dtype=bool)
+        order = np.argsort(names[named], kind='stable')
+        return {
+            'ids': ids,
+            'names': names,
+            'names_sorted': names[named][order],
+            'ids_by_name': ids[named][order],
+        }
+
+    def refresh(self):
+        """Reload the arrays from the database now."""
+        arrays = self._load()
+        with self._lock:
+            self._arrays = arrays
+
+    def invalidate(self):
+        """Drop the arrays; the next lookup reloads them."""
+        with self._lock:
+            self._arrays = None
+
+    def insert(self, names, defaults: dict = None) -> int:
+        """Insert `names` missing from the table in one statement.
+
+        Uses `INSERT ... ON CONFLICT DO NOTHING`, so names added concurrently
+        are skipped. Other required columns are taken from `defaults`. The
+        table's query cache entries are invalidated and the arrays refreshed
+        afterwards. Returns the number of rows inserted.
+        """
+        names = [n for n in names if n is not None]
+        if not names:
+            return 0
+        table = self.table
+        rows = [{self.name_col: n, **(defaults or {})} for n in names]
+        statement = pg_insert(table).values(rows) \
+                                    .on_conflict_do_nothing(
+                                        index_elements=[self.name_col]) \
+                                    .returning(table.c[self.id_col])
+        with get_engine().begin() as conn:
+            inserted = len(conn.execute(statement).all())
+        if inserted:
+            cache.invalidate(table.name)
+        logger.info(f"Inserted {inserted} new rows into {table.name}.")
+        self.refresh()
+        return inserted
+
+    def ids(self, names, missing: str = 'raise',
+            defaults: dict = None) -> np.ndarray:
+        """Vectorized name-to-id resolution of a whole column.
+
+        The names are factorized so each distinct name is looked up once,
+        and the ids are broadcast back through the category codes.
+
+        Parameters
+        ==========
+        names: array-like
+            Names to resolve; a categorical is resolved through its
+            categories directly.
+        missing: str
+            What to do with names that are not in the table: 'raise' a
+            `KeyError`, 'insert' them (see `insert`), or 'null' to return
+            them as missing values.
+
+        Returns
+        =======
+        numpy.ndarray
+            int64 ids, or a float array with NaN for unresolved names when
+            `missing='null'`.
+        """
+        names = pd.Series(names)
+        if pd.api.types.is_categorical_dtype(names):
+            codes = names.cat.codes.to_numpy()
+            uniques = names.cat.categories.to_numpy(dtype=object)
+        else:
+            codes, uniques = pd.factorize(names.astype(object))
+            uniques = np.asarray(uniques, dtype=object)
+        if (codes == -1).any() and missing != 'null':
+            raise KeyError(f"{int((codes == -1).sum())} null names for "
+                           f"{self.table.name}.")
+        ids = self.name_id_map.lookup(uniques, default=-1).astype('int64')
+        unknown = ids == -1
+        if unknown.any() and missing == 'insert':
+            self.insert(uniques[unknown].tolist(), defaults=defaults)
+            ids[unknown] = self.name_id_map.lookup(uniques[unknown], default=-1)
+            unknown = ids == -1
+        if unknown.any() and missing != 'null':
+            raise KeyError(f"{len(uniques[unknown])} names not in "
+                           f"{self.table.name}: {uniques[unknown][:10].tolist()}")
+        if (codes == -1).any() or unknown.any():
+            values = ids.astype('float64')
+            values[unknown] = np.nan
+            return np.where(codes == -1, np.nan, values[codes.clip(0)])
+        return ids[codes]
+
+assets = TableLookup('Asset', 'asset')
+tidemarks = TableLookup('Tidemark', 'tidemark')
+lookups = {
+    'assets': assets,
+    'tidemarks': tidemarks,
 }
-tm_name_id_map = {v:k for k,v in tm_id_name_map.items()}
 
+asset_map = asset_id_name_map = assets.id_name_map
+asset_name_id_map = assets.name_id_map
+tidemark_map = tm_id_name_map = tidemarks.id_name_map
+tm_name_id_map = tidemarks.name_id_map
+
+# Name columns found in import frames and the lookup and id column
+# each one resolves to.
+key_columns = {
+    'asset': (assets, 'asset_id'),
+    'tidemark': (tidemarks, 'tidemark_id'),
+}
+
+def resolve(import_df: pd.DataFrame, db_table=None, missing: str = 'raise',
+            defaults: dict = None) -> pd.DataFrame:
+    """Replace the name columns of an import frame with their ids.
+
+    Every `asset`/`tidemark` column (or index level) is resolved with
+    `TableLookup.ids` and replaced by `asset_id`/`tidemark_id`. Missing names
+    raise, are inserted in one round-trip per table (`missing='insert'`), or
+    have their rows dropped (`missing='drop'`).
+
+    Parameters
+    ==========
+    import_df: pandas.DataFrame
+        Import frame keyed by names.
+    db_table: sqlalchemy.ext.declarative.api.DeclarativeMeta
+        When given, the result is indexed by the table's unique columns,
+        ready for `compare_to_db` or `copy_upsert`.
+    defaults: dict
+        `{table name: {column: value}}` for required columns of inserted
+        dimension rows.
+
+    Returns
+    =======
+    pandas.DataFrame
+    """
+    frame = import_df.reset_index() if any(import_df.index.names) \
+            else import_df.copy()
+    keep = np.ones(len(frame), dtype=bool)
+    for name_col, (lookup, id_col) in key_columns.items():
+        if name_col not in frame.columns:
+            continue
+        ids = lookup.ids(frame[name_col],
+                         missing='null' if missing == 'drop' else missing,
+                         defaults=(defaults or {}).get(lookup.table.name))
+        if ids.dtype.kind == 'f':
+            keep &= ~np.isnan(ids)
+        frame[id_col] = ids
+        frame = frame.drop(columns=name_col)
+    if not keep.all():
+        logger.warning(f"Dropping {int((~keep).sum())} rows with unknown names.")
+        frame = frame[keep]
+    for _, id_col in key_columns.values():
+        if id_col in frame.columns and frame[id_col].dtype.kind == 'f':
+            frame[id_col] = frame[id_col].astype('int64')
+    if db_table is None:
+        return frame
+    _, unique_cols, _ = functions.get_unique_cols(db_table=db_table)
+    return frame.set_index(unique_cols).sort_index()
+
+def _selected(table_name=None):
+    if table_name is None:
+        return list(lookups.values())
+    return [lookups[table_name]] if table_name in lookups else []
+
+def refresh(table_name: str = None):
+    """Reload the maps for `table_name`, or for every table."""
+    for lookup in _selected(table_name):
+        lookup.refresh()
+
+def invalidate(table_name: str = None):
+    """Invalidate the maps for `table_name`, or for every table."""
+    for lookup in _selected(table_name):
+        lookup.invalidate()
+
+def notify(table_name: str, channel: str = notify_channel):
+    """Send a map invalidation notification for `table_name`."""
+    with get_engine().begin() as conn:
+        conn.execute(text("SELECT pg_notify(:channel, :table_name)"),
+                     {'channel': channel, 'table_name': table_name})
+
+def install_notify_triggers(channel: str = notify_channel):
+    """Create statement triggers that `NOTIFY` on changes to mapped tables."""
+    function_name = f"{schema}.lodestar_notify_maps"
+    statements = [f"""
+        CREATE OR REPLACE FUNCTION {function_name}() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{channel}', TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql"""]
+    for table_name in lookups:
+        statements += [
+            f"DROP TRIGGER IF EXISTS lodestar_notify_maps "
+            f"ON {schema}.{table_name}",
+            f"CREATE TRIGGER lodestar_notify_maps "
+            f"AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE "
+            f"ON {schema}.{table_name} "
+            f"FOR EACH STATEMENT EXECUTE PROCEDURE {function_name}()"]
+    with get_engine().begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+
+class MapListener(threading.Thread):
+    """Daemon thread invalidating maps on `LISTEN <channel>` notifications.
+
+    The notification payload is the changed table's name; an empty payload
+    invalidates every map. The listener holds its own connection, detached
+    from the engine's pool. If it drops, the thread reconnects with
+    exponential backoff (up to `max_backoff` seconds) and invalidates every
+    map, since notifications sent meanwhile were lost.
+    """
+    def __init__(self, channel: str = notify_channel, poll_seconds: float = 5.0,
+                 max_backoff: float = 60.0):
+        super().__init__(name=f"lodestar-{channel}-listener", daemon=True)
+        self.channel = channel
+        self.poll_seconds = poll_seconds
+        self.max_backoff = max_backoff
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _connect(self):
+        raw_connection = get_engine().raw_connection()
+        # A LISTENing autocommit connection must never go back to the pool.
+        raw_connection.detach()
+        raw_connection.connection.autocommit = True
+        with raw_connection.connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+        return raw_connection
+
+    def _close(self, raw_connection):
+        try:
+            with raw_connection.connection.cursor() as cursor:
+                cursor.execute("UNLISTEN *")
+        except Exception:
+            pass
+        finally:
+            raw_connection.close()
 
+    def _listen(self, dbapi_connection):
+        while not self._stop_event.is_set():
+            ready, _, _ = select.select([dbapi_connection], [], [],
+                                        self.poll_seconds)
+            if not ready:
+                continue
+            dbapi_connection.poll()
+            while dbapi_connection.notifies:
+                notification = dbapi_connection.notifies.pop(0)
+                logger.info(f"Invalidating maps: {notification.payload!r}")
+                invalidate(notification.payload or None)
 
-# account_map = {a.id:a for a in all_query(Account)}
+    def run(self):
+        dbapi = get_engine().dialect.dbapi
+        errors = (exc.DBAPIError, dbapi.OperationalError, dbapi.InterfaceError)
+        backoff = 0
+        while not self._stop_event.is_set():
+            try:
+                raw_connection = self._connect()
+            except errors as e:
+                backoff = min(max(backoff * 2, 1), self.max_backoff)
+                logger.warning(f"Map listener could not connect ({e!r}); "
+                               f"retrying in {backoff:.0f}s.")
+                self._stop_event.wait(backoff)
+                continue
+            if backoff:
+                logger.info("Map listener reconnected; invalidating all maps.")
+                invalidate()
+                backoff = 0
+            try:
+                self._listen(raw_connection.connection)
+            except errors as e:
+                backoff = 1
+                logger.warning(f"Map listener lost its connection: {e!r}")
+            finally:
+                self._close(raw_connection)
 
+def listen(channel: str = notify_channel) -> MapListener:
+    """Start and return a `MapListener` for `channel`."""
+    listener = MapListener(channel)
+    listener.start()
+    return listener
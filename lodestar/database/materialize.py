@@ -0,0 +1,265 @@
+"""Incremental maintenance of `tidemark_history_daily`.
+
+The daily series is `tidemark_history` forward-filled onto each asset's
+trading dates (the dates of its `price_history` rows). A history row dated
+`d` only determines the daily values from `d` up to the next history row
+of the same asset and tidemark, so after a load only those ranges are
+recomputed and upserted through `loader.copy_upsert`; unchanged daily rows
+are not rewritten. History and prices are read per key from its own
+`start`, so one old restatement does not widen the read for other keys.
+
+Prices loaded after the last refresh add trading dates without any history
+change. Pass `extend` to `refresh`/`refresh_since` to also carry those
+assets' daily series forward to their latest price date (`stale_keys`).
+
+Methods
+-------
+refresh(changes)->int, int
+    Recompute the daily ranges affected by new `tidemark_history` rows.
+
+refresh_since(since)->int, int
+    Same, for history rows modified after a `last_modified` timestamp.
+
+rebuild(asset_ids=None, tidemark_ids=None)->int, int
+    Recompute whole daily series.
+
+stale_keys(asset_ids=None)->pandas.DataFrame
+    Daily series that end before their asset's latest price date.
+"""
+import pandas as pd
+from sqlalchemy import select, func, values, column, and_
+from . import models
+from . import metrics
+from . import loader
+from .asof import asof_join
+from .functions import rows_to_dataframe
+from .. import logger
+
+key_cols = ['asset_id', 'tidemark_id']
+
+def affected_keys(changes: pd.DataFrame) -> pd.DataFrame:
+    """First and last changed date per `(asset_id, tidemark_id)`.
+
+    `changes` holds `asset_id`, `tidemark_id` and `date`, as columns or
+    index levels, e.g. the import dataframe just loaded into
+    `tidemark_history`.
+    """
+    if any(changes.index.names):
+        changes = changes.reset_index()
+    changes = changes[key_cols + ['date']].assign(
+        date=pd.to_datetime(changes['date']))
+    return changes.groupby(key_cols)['date'].agg(['min', 'max']) \
+                  .rename(columns={'min': 'start', 'max': 'last'}) \
+                  .reset_index()
+
+def modified_keys(since) -> pd.DataFrame:
+    """`affected_keys` of the history rows modified after `since`."""
+    table = models.TidemarkHistory.__table__
+    statement = select(table.c.asset_id, table.c.tidemark_id,
+                       func.min(table.c.date).label('start'),
+                       func.max(table.c.date).label('last')) \
+                .where(table.c.last_modified > since) \
+                .group_by(table.c.asset_id, table.c.tidemark_id)
+    rows = models.session.execute(statement).fetchall()
+    keys = pd.DataFrame(rows, columns=key_cols + ['start', 'last'])
+    return keys.assign(start=pd.to_datetime(keys['start']),
+                       last=pd.to_datetime(keys['last']))
+
+def stale_keys(asset_ids=None) -> pd.DataFrame:
+    """Keys whose daily series stops before the asset's latest price date.
+
+    `start` is the day after the last daily row (the first history date when
+    there is none) and `last` the latest history date, so the recomputed
+    range runs to the end of the asset's prices. Without `asset_ids` this
+    groups the whole of `tidemark_history`, `tidemark_history_daily` and
+    `price_history`.
+    """
+    history = models.TidemarkHistory.__table__
+    daily = models.TidemarkDaily.__table__
+    prices = models.PriceHistory.__table__
+    keys = select(history.c.asset_id, history.c.tidemark_id,
+                  func.min(history.c.date).label('first'),
+                  func.max(history.c.date).label('last')) \
+           .group_by(history.c.asset_id, history.c.tidemark_id)
+    filled = select(daily.c.asset_id, daily.c.tidemark_id,
+                    func.max(daily.c.date).label('filled')) \
+             .group_by(daily.c.asset_id, daily.c.tidemark_id)
+    latest = select(prices.c.asset_id, func.max(prices.c.date).label('latest')) \
+             .group_by(prices.c.asset_id)
+    if asset_ids is not None:
+        asset_ids = [int(i) for i in asset_ids]
+        keys = keys.where(history.c.asset_id.in_(asset_ids))
+        filled = filled.where(daily.c.asset_id.in_(asset_ids))
+        latest = latest.where(prices.c.asset_id.in_(asset_ids))
+    keys, filled, latest = keys.subquery(), filled.subquery(), latest.subquery()
+    statement = select(keys.c.asset_id, keys.c.tidemark_id, keys.c.first,
+                       filled.c.filled, keys.c.last) \
+                .join_from(keys, latest, keys.c.asset_id == latest.c.asset_id) \
+                .outerjoin(filled, (keys.c.asset_id == filled.c.asset_id)
+                                   & (keys.c.tidemark_id == filled.c.tidemark_id)) \
+                .where((filled.c.filled.is_(None))
+                       | (filled.c.filled < latest.c.latest))
+    rows = models.session.execute(statement).fetchall()
+    frame = pd.DataFrame(rows, columns=key_cols + ['first', 'filled', 'last'])
+    start = (pd.to_datetime(frame['filled']) + pd.Timedelta(days=1)) \
+            .fillna(pd.to_datetime(frame['first']))
+    return frame[key_cols].assign(start=start,
+                                  last=pd.to_datetime(frame['last']))
+
+def _with_stale(keys: pd.DataFrame, extend) -> pd.DataFrame:
+    """`keys` plus `stale_keys`, one `(start, last)` span per key.
+
+    `extend` is `None`/`False` (no extension), `True` (the assets in `keys`)
+    or a list of asset ids.
+    """
+    if extend is None or extend is False:
+        return keys
+    asset_ids = keys['asset_id'].unique().tolist() if extend is True else extend
+    if not len(asset_ids):
+        return keys
+    stale = stale_keys(asset_ids)
+    if stale.empty:
+        return keys
+    return pd.concat([keys, stale], ignore_index=True) \
+             .groupby(key_cols).agg(start=('start', 'min'), last=('last', 'max')) \
+             .reset_index()
+
+def _ranges(keys: pd.DataFrame, history: pd.DataFrame) -> pd.DataFrame:
+    """Add `stop`, the next history date after each key's last change."""
+    later = history.merge(keys[key_cols + ['last']], on=key_cols)
+    later = later[later['date'] > later['last']]
+    stops = later.groupby(key_cols)['date'].min().rename('stop')
+    return keys.merge(stops.reset_index(), on=key_cols, how='left')
+
+def _spans(frame: pd.DataFrame, cols: list, name: str):
+    """`frame[cols + ['start']]` as a `VALUES` list to join on."""
+    table = models.TidemarkHistory.__table__
+    rows = [tuple(int(v) for v in row[:-1]) + (row[-1].date(),)
+            for row in frame[cols + ['start']].itertuples(index=False, name=None)]
+    return values(*[column(c, table.c[c].type) for c in cols],
+                  column('start', table.c.date.type), name=name).data(rows)
+
+def _history(keys: pd.DataFrame) -> pd.DataFrame:
+    """History rows of each key from its `start`, plus the row before it."""
+    db_table = models.TidemarkHistory
+    table = db_table.__table__
+    spans = _spans(keys, key_cols, 'spans')
+    on = and_(*[table.c[c] == spans.c[c] for c in key_cols])
+    recent = select(table).join(spans, on).where(table.c.date >= spans.c.start)
+    seed = select(table).distinct(table.c.asset_id, table.c.tidemark_id) \
+                        .join(spans, on).where(table.c.date < spans.c.start) \
+                        .order_by(table.c.asset_id, table.c.tidemark_id,
+                                  table.c.date.desc())
+    frames = []
+    for statement in (seed, recent):
+        result = models.session.execute(statement)
+        frames.append(rows_to_dataframe(result.fetchall(), list(result.keys()),
+                                        db_table))
+    return pd.concat(frames).sort_index()
+
+def _trading_dates(keys: pd.DataFrame) -> pd.DataFrame:
+    """`price_history` dates of each asset from its earliest key `start`."""
+    table = models.PriceHistory.__table__
+    starts = keys.groupby('asset_id', as_index=False)['start'].min()
+    spans = _spans(starts, ['asset_id'], 'asset_spans')
+    statement = select(table.c.asset_id, table.c.date) \
+                .join(spans, table.c.asset_id == spans.c.asset_id) \
+                .where(table.c.date >= spans.c.start)
+    dates = pd.DataFrame(models.session.execute(statement).fetchall(),
+                         columns=['asset_id', 'date'])
+    return dates.assign(asset_id=dates['asset_id'].astype('int64'),
+                        date=pd.to_datetime(dates['date']))
+
+def daily_frame(keys: pd.DataFrame, value_col: str = 'value') -> pd.DataFrame:
+    """Daily values for the date ranges in `keys`.
+
+    Parameters
+    ==========
+    keys: pandas.DataFrame
+        `asset_id`, `tidemark_id` and the `start` and `last` changed dates,
+        as returned by `affected_keys`.
+
+    Returns
+    =======
+    pandas.DataFrame
+        `value_col` indexed by `(asset_id, tidemark_id, date)`, for every
+        trading date from each key's `start` up to (excluding) the next
+        history row after `last`.
+    """
+    history = _history(keys).reset_index()
+    ranges = _ranges(keys, history)
+    dates = _trading_dates(keys)
+    panel = asof_join(dates, history, value_col=value_col)
+    panel.columns.name = 'tidemark_id'
+    if panel.columns.empty:
+        return pd.DataFrame(columns=key_cols + ['date', value_col]) \
+                 .set_index(key_cols + ['date'])
+
+    daily = panel.stack().rename(value_col).reset_index()
+    daily = daily.merge(ranges, on=key_cols)
+    in_range = (daily['date'] >= daily['start']) \
+               & (daily['stop'].isna() | (daily['date'] < daily['stop']))
+    return daily.loc[in_range, key_cols + ['date', value_col]] \
+                .set_index(key_cols + ['date']) \
+                .sort_index()
+
+def _materialize(keys: pd.DataFrame, value_col: str, debug: bool) -> (int, int):
+    if keys.empty:
+        return 0, 0
+    daily = daily_frame(keys, value_col=value_col)
+    if debug:
+        print(f"Materializing {len(daily)} daily rows for {len(keys)} "
+              f"asset/tidemark pairs.")
+    inserted, updated = loader.copy_upsert(daily, models.TidemarkDaily)
+    logger.info(f"tidemark_history_daily: {inserted} inserted, "
+                f"{updated} updated for {len(keys)} asset/tidemark pairs.")
+    return inserted, updated
+
+@metrics.timed
+def refresh(changes: pd.DataFrame, value_col: str = 'value', extend=None,
+            debug: bool = False) -> (int, int):
+    """Recompute the daily rows affected by the history rows in `changes`.
+
+    `extend` also carries daily series forward to their asset's latest price
+    date (see `stale_keys`): `True` for the assets in `changes`, or a list
+    of asset ids, e.g. those whose prices were just loaded.
+
+    Returns
+    =======
+    inserted, updated: int
+        Daily rows inserted and updated.
+    """
+    return _materialize(_with_stale(affected_keys(changes), extend),
+                        value_col, debug)
+
+@metrics.timed
+def refresh_since(since, value_col: str = 'value', extend=None,
+                  debug: bool = False) -> (int, int):
+    """Recompute the daily rows affected by history modified after `since`.
+
+    `since` is compared to `tidemark_history.last_modified`, which
+    `copy_upsert` sets on every insert and update. `extend` is as in
+    `refresh`.
+    """
+    return _materialize(_with_stale(modified_keys(since), extend),
+                        value_col, debug)
+
+@metrics.timed
+def rebuild(asset_ids=None, tidemark_ids=None, value_col: str = 'value',
+            debug: bool = False) -> (int, int):
+    """Recompute the whole daily series of the given assets and tidemarks."""
+    table = models.TidemarkHistory.__table__
+    statement = select(table.c.asset_id, table.c.tidemark_id,
+                       func.min(table.c.date).label('start')) \
+                .group_by(table.c.asset_id, table.c.tidemark_id)
+    if asset_ids is not None:
+        statement = statement.where(table.c.asset_id.in_([int(i) for i in asset_ids]))
+    if tidemark_ids is not None:
+        statement = statement.where(
+            table.c.tidemark_id.in_([int(i) for i in tidemark_ids]))
+    rows = models.session.execute(statement).fetchall()
+    keys = pd.DataFrame(rows, columns=key_cols + ['start'])
+    # No history row is after `last`, so every range is open-ended.
+    keys = keys.assign(start=pd.to_datetime(keys['start']),
+                       last=pd.Timestamp.max)
+    return _materialize(keys, value_col, debug)
@@ -0,0 +1,206 @@
+"""In-process query and load instrumentation.
+
+Once `enable()` is called, every statement executed through the shared
+engine is timed with SQLAlchemy engine events, and the `functions.py` entry
+points record their duration and row counts (ORM hydration in
+`all_query`/`filter_query`, DataFrame building in `collection_to_dataframe`/
+`rows_to_dataframe`, batch commits in `load_objects`, ...). Statements
+slower than `slow_query_ms` are written to the slow-query log.
+
+Instrumentation is off by default and costs a single flag check per call.
+
+Methods
+-------
+enable(slow_query_ms=None, log_file=None), disable()
+    Turn instrumentation on or off.
+
+summary()->pandas.DataFrame, dump()->str
+    Aggregated timings per statement, call and batch; `batch` rows give
+    the write throughput per table.
+
+reset()
+    Clear the registry.
+"""
+import os
+import re
+import time
+import logging
+import threading
+import functools
+from collections import defaultdict
+from contextlib import contextmanager
+import pandas as pd
+from sqlalchemy import event
+from . import get_engine
+from .. import logger
+
+slow_query_logger = logging.getLogger('lodestar.database.slow_queries')
+
+class Registry:
+    """Thread-safe aggregate of timings keyed by `(kind, name)`.
+
+    At most `max_keys` distinct keys are kept; later new names of a kind are
+    aggregated under `(kind, '<other>')`.
+    """
+    def __init__(self, max_keys: int = 2000):
+        self.enabled = False
+        self.slow_query_seconds = None
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'count': 0, 'seconds': 0.0,
+                                           'max_seconds': 0.0, 'rows': 0})
+
+    def record(self, kind: str, name: str, seconds: float, rows: int = None):
+        with self._lock:
+            if (kind, name) not in self._stats \
+                    and len(self._stats) >= self.max_keys:
+                name = '<other>'
+            stats = self._stats[(kind, name)]
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            if rows is not None and rows >= 0:
+                stats['rows'] += rows
+
+    @contextmanager
+    def timer(self, kind: str, name: str):
+        """Time the enclosed block; set `['rows']` on the yielded dict."""
+        if not self.enabled:
+            yield {}
+            return
+        measurement = {'rows': None}
+        start = time.perf_counter()
+        try:
+            yield measurement
+        finally:
+            self.record(kind, name, time.perf_counter() - start,
+                        measurement['rows'])
+
+    def summary(self) -> pd.DataFrame:
+        with self._lock:
+            rows = [{'kind': kind, 'name': name, **stats}
+                    for (kind, name), stats in self._stats.items()]
+        columns = ['kind', 'name', 'count', 'seconds', 'max_seconds', 'rows']
+        summary = pd.DataFrame(rows, columns=columns)
+        summary['mean_seconds'] = summary['seconds'] / summary['count']
+        summary['rows_per_second'] = summary['rows'] / summary['seconds']
+        return summary.set_index(['kind', 'name']) \
+                      .sort_values('seconds', ascending=False)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+registry = Registry()
+
+def _row_count(result):
+    if isinstance(result, tuple):
+        counts = [len(r) for r in result if hasattr(r, '__len__')]
+        return sum(counts) if counts else None
+    if hasattr(result, '__len__') and not isinstance(result, (str, bytes)):
+        return len(result)
+    return None
+
+def timed(function):
+    """Record the duration and result size of `function` when enabled."""
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not registry.enabled:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        registry.record('call', name, time.perf_counter() - start,
+                        _row_count(result))
+        return result
+    return wrapper
+
+_literals = [(re.compile(r"'(?:[^']|'')*'"), '?'),
+             (re.compile(r'%\(\w+\)s|%s'), '?'),
+             (re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?'), '?'),
+             (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?)'),
+             (re.compile(r'\(\?\)(?:\s*,\s*\(\?\))+'), '(?), ...')]
+
+def _statement_name(statement: str) -> str:
+    """Statement text with literals, parameters and value lists replaced by
+    `?`, so the same query with other values shares one registry key."""
+    name = re.sub(r'\s+', ' ', statement).strip()
+    for pattern, replacement in _literals:
+        name = pattern.sub(replacement, name)
+    return name[:200]
+
+_start_key = 'lodestar_query_start'
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault(_start_key, []).append(time.perf_counter())
+
+def _handle_error(exception_context):
+    # A failed statement never reaches `after_cursor_execute`.
+    connection = exception_context.connection
+    if connection is not None:
+        connection.info.pop(_start_key, None)
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    starts = conn.info.get(_start_key)
+    if not starts:
+        # Started before `enable()`.
+        return
+    seconds = time.perf_counter() - starts.pop()
+    registry.record('sql', _statement_name(statement), seconds, cursor.rowcount)
+    if registry.slow_query_seconds is not None \
+            and seconds >= registry.slow_query_seconds:
+        slow_query_logger.warning(
+            f"{seconds * 1000:.1f} ms, {cursor.rowcount} rows: "
+            f"{_statement_name(statement)} {parameters!r:.500}")
+
+def enable(slow_query_ms: float = None, log_file: str = None):
+    """Start recording statement and call timings.
+
+    Parameters
+    ==========
+    slow_query_ms: float
+        Log statements taking at least this long to the slow-query log.
+    log_file: str
+        Also write the slow-query log to this file; enabling again with the
+        same file does not add a second handler.
+    """
+    engine = get_engine()
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
+    registry.slow_query_seconds = None if slow_query_ms is None \
+                                  else slow_query_ms / 1000
+    if log_file and not any(
+            isinstance(h, logging.FileHandler)
+            and h.baseFilename == os.path.abspath(log_file)
+            for h in slow_query_logger.handlers):
+        handler = logging.FileHandler(log_file)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_query_logger.addHandler(handler)
+    registry.enabled = True
+
+def disable():
+    """Stop recording; the collected timings are kept until `reset()`."""
+    registry.enabled = False
+    engine = get_engine()
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.remove(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.remove(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.remove(engine, 'handle_error', _handle_error)
+
+def summary() -> pd.DataFrame:
+    """Aggregated timings, slowest total first."""
+    return registry.summary()
+
+def dump(top: int = 25) -> str:
+    """Log and return a text table of the `top` entries of `summary()`."""
+    text = summary().head(top).to_string(float_format=lambda x: f"{x:.4f}")
+    logger.info(f"Query and load timings:\n{text}")
+    return text
+
+def reset():
+    registry.reset()
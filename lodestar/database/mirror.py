@@ -0,0 +1,219 @@
+"""Local Parquet mirror of the history tables.
+
+Rows of `price_history` and `tidemark_history` are kept under
+`TTG_DATA_DIRECTORY/mirror/<table>/` in one Parquet file per asset, next to a
+`_watermarks.json` file holding each partition's high-water mark on
+`last_modified`, which `copy_upsert` sets on every insert and update (so
+restated rows are picked up too). `sync` fetches only the rows past each
+partition's own mark and `read` serves dataframes from memory-mapped files, so
+repeated research runs do not go to the database.
+
+`last_modified` is stamped when a writing transaction starts, so a long
+transaction can commit rows older than a mark already taken. Each `sync`
+therefore refetches `watermark_overlap` before the mark and skips the rows
+whose watermark value is already mirrored. Deleted rows are not detected;
+`reset` the affected assets to mirror them from scratch on the next `sync`.
+
+Requires `pyarrow` (`pip install tidemarks[mirror]`).
+
+Methods
+-------
+sync(db_table, asset_ids=None)->dict
+    Incrementally refresh the mirror, returning rows written per asset.
+
+read(db_table, asset_ids=None, columns=None)->pandas.DataFrame
+    Read mirrored rows indexed by the table's unique columns.
+
+reset(db_table, asset_ids=None)
+    Drop mirrored partitions and their watermarks.
+"""
+import os
+import json
+import pandas as pd
+from sqlalchemy import select, values, column, and_
+from .. import data_file_dir
+from . import models
+from . import maps
+from .functions import filter_frame, rows_to_dataframe
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+mirror_dir = os.path.join(data_file_dir, 'mirror')
+partition_col = 'asset_id'
+# Refetch window before each watermark, covering transactions that were
+# still open when the previous `sync` read the table.
+watermark_overlap = pd.Timedelta(minutes=10)
+
+def _require_pyarrow():
+    if pq is None:
+        raise ImportError("The Parquet mirror requires `pyarrow`; "
+                          "install it with `pip install pyarrow`.")
+
+def table_dir(db_table) -> str:
+    return os.path.join(mirror_dir, db_table.__table__.name)
+
+def partition_path(db_table, asset_id) -> str:
+    return os.path.join(table_dir(db_table), f"{partition_col}={int(asset_id)}.parquet")
+
+def watermark_col(db_table) -> str:
+    """Column used to detect new or changed rows."""
+    table_object = db_table.__table__
+    if 'last_modified' not in table_object.columns:
+        raise ValueError(f"{table_object.name} has no `last_modified` column "
+                         f"to mirror changes by.")
+    return 'last_modified'
+
+def load_watermarks(db_table) -> dict:
+    path = os.path.join(table_dir(db_table), '_watermarks.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fh:
+        return {int(k): pd.Timestamp(v) for k, v in json.load(fh).items()}
+
+def save_watermarks(db_table, watermarks: dict):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as fh:
+            json.dump({str(k): v.isoformat() for k, v in watermarks.items()},
+                      fh, indent=1)
+    _replace(os.path.join(table_dir(db_table), '_watermarks.json'), write)
+
+def _replace(path, write):
+    """Write to a temporary file and move it into place atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _read_partition(path, columns=None) -> pd.DataFrame:
+    table = pq.read_table(path, columns=columns, memory_map=True,
+                          use_pandas_metadata=True)
+    return table.to_pandas()
+
+def _since_select(db_table, watermarks: dict):
+    """Rows of each asset from `watermark_overlap` before its own mark,
+    joined to the marks as a `VALUES` list."""
+    table_object = db_table.__table__
+    col = table_object.c[watermark_col(db_table)]
+    asset_col = table_object.c[partition_col]
+    marks = values(column(partition_col, asset_col.type),
+                   column('since', col.type), name='watermarks') \
+        .data([(int(a), (mark - watermark_overlap).to_pydatetime())
+               for a, mark in watermarks.items()])
+    return select(table_object) \
+        .join(marks, and_(asset_col == marks.c[partition_col],
+                          col >= marks.c.since)) \
+        .order_by(*[c for c in table_object.primary_key.columns])
+
+def _fetch_changes(db_table, asset_ids: list, watermarks: dict) -> pd.DataFrame:
+    """Rows from `watermark_overlap` before each asset's watermark, in at
+    most two queries."""
+    asset_col = getattr(db_table, partition_col)
+    known = [a for a in asset_ids if a in watermarks]
+    new = [a for a in asset_ids if a not in watermarks]
+
+    frames = []
+    if known:
+        result = models.session.execute(
+            _since_select(db_table, {a: watermarks[a] for a in known}))
+        frames.append(rows_to_dataframe(result.fetchall(), list(result.keys()),
+                                        db_table, drop_last_modified=False))
+    if new:
+        frames.append(filter_frame(db_table, [asset_col.in_(new)],
+                                   drop_last_modified=False, cached=False))
+    frames = [f for f in frames if not f.empty]
+    return pd.concat(frames) if frames else pd.DataFrame()
+
+def sync(db_table, asset_ids: list = None, debug: bool = False) -> dict:
+    """Bring the mirror of `db_table` up to date.
+
+    Each asset partition is refreshed only with rows whose watermark column
+    is within `watermark_overlap` of that partition's mark or past it; rows
+    whose watermark value differs from the mirrored one replace their
+    mirrored version by unique key.
+
+    Returns
+    =======
+    dict
+        Number of new or changed rows written, keyed by asset id.
+    """
+    _require_pyarrow()
+    if asset_ids is None:
+        asset_ids = list(maps.asset_map)
+    asset_ids = [int(a) for a in asset_ids]
+    col = watermark_col(db_table)
+    watermarks = load_watermarks(db_table)
+
+    changes = _fetch_changes(db_table, asset_ids, watermarks)
+    if debug:
+        print(f"Fetched {len(changes)} new or changed rows.")
+    if changes.empty:
+        return {}
+
+    written = {}
+    levels = changes.index.get_level_values(partition_col).astype(int)
+    for asset_id, rows in changes.groupby(levels):
+        mark = watermarks.get(asset_id)
+        if mark is not None:
+            rows = rows[rows[col] >= mark - watermark_overlap]
+        path = partition_path(db_table, asset_id)
+        existing = _read_partition(path) if os.path.exists(path) else None
+        if existing is not None:
+            # Rows refetched by the overlap window are already mirrored.
+            rows = rows[rows[col] != existing[col].reindex(rows.index)]
+        if rows.empty:
+            continue
+
+        written[asset_id] = len(rows)
+        if existing is not None:
+            rows = pd.concat([existing[~existing.index.isin(rows.index)], rows])
+        rows = rows.sort_index()
+        _replace(path, lambda tmp: pq.write_table(
+            pa.Table.from_pandas(rows, preserve_index=True), tmp))
+
+        watermarks[asset_id] = pd.Timestamp(rows[col].max())
+
+    # Partitions are merged by key, so a crash before this only causes refetches.
+    save_watermarks(db_table, watermarks)
+    return written
+
+def read(db_table, asset_ids: list = None, columns: list = None) -> pd.DataFrame:
+    """Read mirrored rows of `db_table` from memory-mapped Parquet files.
+
+    The result matches `filter_frame` for the same assets (with
+    `last_modified` kept), indexed by the table's unique columns.
+    """
+    _require_pyarrow()
+    if asset_ids is None:
+        directory = table_dir(db_table)
+        paths = sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                       if f.endswith('.parquet')) \
+                if os.path.isdir(directory) else []
+    else:
+        paths = [partition_path(db_table, a) for a in asset_ids]
+        paths = [p for p in paths if os.path.exists(p)]
+
+    frames = [_read_partition(p, columns=columns) for p in paths]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames).sort_index()
+
+def reset(db_table, asset_ids: list = None):
+    """Remove the mirrored partitions and watermarks of `asset_ids` (all by
+    default), e.g. after rows were deleted from `db_table`."""
+    watermarks = load_watermarks(db_table)
+    if asset_ids is None:
+        directory = table_dir(db_table)
+        asset_ids = [int(f[len(partition_col) + 1:-len('.parquet')])
+                     for f in os.listdir(directory) if f.endswith('.parquet')] \
+                    if os.path.isdir(directory) else []
+        asset_ids = set(asset_ids) | set(watermarks)
+    for asset_id in asset_ids:
+        path = partition_path(db_table, asset_id)
+        if os.path.exists(path):
+            os.remove(path)
+        watermarks.pop(int(asset_id), None)
+    save_watermarks(db_table, watermarks)
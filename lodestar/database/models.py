@@ -16,11 +16,26 @@ Objects
 =======
 tables : list
     table names from the database from which to make objects
+prepare()
+    Reflects `tables` and builds the automapped classes on first use.
+    `Base`, the model classes and `session` are resolved through it lazily.
+session : sqlalchemy.orm.scoped_session
+    Thread-local session; each thread gets its own from `Session`. Call
+    `session.remove()` when a worker thread is done.
+schema cache
+    Opt-in on-disk copy of the reflected MetaData (`TTG_SCHEMA_CACHE`),
+    invalidated by `TTG_SCHEMA_VERSION`.
 """
-from . import engine, metadata
+import os
+import pickle
+import hashlib
+import threading
+import sqlalchemy
+from . import get_engine, get_metadata, get_url, set_metadata, schema
+from .. import data_file_dir, logger
 from sqlalchemy import (Boolean, Column, Date, DateTime, ForeignKey, Float, 
                         Integer, Table, Text, UniqueConstraint)
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, scoped_session, relationship
 from sqlalchemy.ext.automap import automap_base
 import warnings
 from sqlalchemy import exc as sa_exc
@@ -35,13 +50,89 @@ tables = ['assets',
             'tidemark_terms',
             'tidemark_types']
 
-# Extract MetaData and create tables from them using AutoMap.
-metadata.reflect(
-    extend_existing=True,
-    views=True,
-    only=tables)
+# Model names resolved lazily by `prepare()`, keyed to their table names.
+class_tables = {
+    'Asset': 'assets',
+    'PriceHistory': 'price_history',
+    'TidemarkHistory': 'tidemark_history',
+    'TidemarkDaily': 'tidemark_history_daily',
+    'Tidemark': 'tidemarks',
+    'TidemarkType': 'tidemark_types',
+}
+
+## SCHEMA CACHE
+# Opt in with `TTG_SCHEMA_CACHE=1` (cache file in `TTG_DATA_DIRECTORY`) or
+# `TTG_SCHEMA_CACHE=<path>`. Bump `TTG_SCHEMA_VERSION` after a migration to
+# invalidate every cached copy.
+schema_cache = os.environ.get('TTG_SCHEMA_CACHE', '')
+schema_version = os.environ.get('TTG_SCHEMA_VERSION', '')
+
+def schema_cache_path():
+    """Return the schema cache file path, or `None` if caching is disabled."""
+    if schema_cache.lower() in ('', '0', 'false', 'no'):
+        return None
+    if schema_cache.lower() in ('1', 'true', 'yes'):
+        return os.path.join(data_file_dir, 'schema_cache.pickle')
+    return schema_cache
+
+def schema_cache_key():
+    """Version key for the cached MetaData.
+
+    Changes whenever the reflected table list, the schema, the database url,
+    the SQLAlchemy version or `TTG_SCHEMA_VERSION` change.
+    """
+    parts = [schema, ','.join(tables), sqlalchemy.__version__, schema_version,
+             get_url().render_as_string(hide_password=True)]
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+def load_schema_cache():
+    """Return the cached MetaData if it exists and its key is current."""
+    path = schema_cache_path()
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as fh:
+            cached = pickle.load(fh)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable schema cache {path}: {e}")
+        return None
+    if cached.get('key') != schema_cache_key():
+        return None
+    return cached['metadata']
+
+def dump_schema_cache(metadata):
+    """Write the reflected MetaData to the schema cache file."""
+    path = schema_cache_path()
+    if not path:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as fh:
+        pickle.dump({'key': schema_cache_key(), 'metadata': metadata}, fh,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def clear_schema_cache():
+    """Delete the schema cache file so the next `prepare()` reflects again."""
+    path = schema_cache_path()
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def reflect_metadata():
+    """Return MetaData for `tables`, from the schema cache when possible."""
+    metadata = load_schema_cache()
+    if metadata is not None:
+        return set_metadata(metadata)
+
+    # Extract MetaData and create tables from them using AutoMap.
+    metadata = get_metadata()
+    metadata.reflect(
+        extend_existing=True,
+        views=True,
+        only=tables)
+    dump_schema_cache(metadata)
+    return metadata
 
-Base = automap_base(metadata=metadata)
 ## >>> INSERT VIEW DEFINITIONS HERE
 def name_for_collection_relationship(base, local_cls, referred_cls, constraint):
     reflexive_names = {
@@ -60,29 +151,58 @@ def name_for_collection_relationship(base, local_cls, referred_cls, constraint):
     else:
         return referred_cls.__name__.lower() + "_collection"
 
-Base.prepare(reflect=True,
-             name_for_collection_relationship=name_for_collection_relationship)
+_prepare_lock = threading.RLock()
+
+def prepare():
+    """Reflect the database and build the automapped classes.
+
+    Runs once, on first access to `Base`, a model class or `session`. The
+    MetaData is already reflected for `tables`, so `Base.prepare` only maps it
+    and does not reflect the schema a second time.
+    """
+    with _prepare_lock:
+        if 'Base' in globals():
+            return globals()['Base']
+
+        Base = automap_base(metadata=reflect_metadata())
+        Base.prepare(
+            name_for_collection_relationship=name_for_collection_relationship)
+
+        ## TABLE DEFINITIONS
+        models = {name: getattr(Base.classes, table_name)
+                  for name, table_name in class_tables.items()}
+        Asset, PriceHistory = models['Asset'], models['PriceHistory']
+
+        ## CUSTOM RELATIONSHIP DEFINITIONS
+        Asset.current_price = relationship(PriceHistory,
+                                    primaryjoin=(Asset.id==PriceHistory.asset_id),
+                                    order_by=lambda: PriceHistory.date.desc(),
+                                    uselist=False)
 
-## TABLE DEFINITIONS
-Asset = Base.classes.assets
-PriceHistory = Base.classes.price_history
-TidemarkHistory = Base.classes.tidemark_history
-TidemarkDaily = Base.classes.tidemark_history_daily
-Tidemark = Base.classes.tidemarks
-TidemarkType = Base.classes.tidemark_types
+        globals().update(models)
+        globals()['Base'] = Base
+        return Base
 
-## CUSTOM RELATIONSHIP DEFINITIONS
-Asset.current_price = relationship(PriceHistory,
-                                primaryjoin=(Asset.id==PriceHistory.asset_id),
-                                order_by=lambda: PriceHistory.date.desc(),
-                                uselist=False)
+# Session factory; `session` is a thread-local registry of its sessions.
+Session = sessionmaker(expire_on_commit=False)
 
-# Instantiate a session for querying.
-Session = sessionmaker()
-session = Session(bind=engine, expire_on_commit=False)
+def __getattr__(name):
+    """Resolve `Base`, the model classes and `session` lazily (PEP 562)."""
+    if name == 'Base' or name in class_tables:
+        prepare()
+        return globals()[name]
+    if name == 'session':
+        with _prepare_lock:
+            if 'session' not in globals():
+                prepare()
+                Session.configure(bind=get_engine())
+                globals()['session'] = scoped_session(Session)
+            return globals()['session']
+    raise AttributeError(
+        f"module {__name__!r} has no attribute {name!r}")
 
 if __name__=='__main__':
-    for c in Base.classes:
+    for c in prepare().classes:
         print(c.__table__.name)
 
 
@@ -0,0 +1,245 @@
+"""Dense date-by-asset panels in memory-mapped files.
+
+A panel holds one value column of a history table (e.g. `price_history.price`
+or one tidemark of `tidemark_history_daily`) as a row-major date x asset
+matrix under `TTG_DATA_DIRECTORY/panels/<name>/`:
+
+    meta.json               dtype, shape, source and version of the panel
+    <version>/values.bin    float32/float64 matrix, one row per date
+    <version>/dates.npy     datetime64[D] row axis
+    <version>/asset_ids.npy int64 column axis
+
+The matrix is filled straight from `iter_frames` chunks by position, with no
+pivot. `build` writes a new version directory and `update` appends new dates
+as rows to the current one; either way `meta.json` is replaced last, so
+readers in other processes can map the files at any time and see a
+consistent panel of `meta['dates']` rows of the version it names. The
+previous version is kept for readers that read the old `meta.json`.
+
+Methods
+-------
+build(name, db_table, value_col)->Panel
+    Write a panel from scratch.
+
+update(name)->Panel
+    Append the dates loaded since the panel was last built or updated.
+
+load(name)->Panel
+    Map an existing panel read-only.
+"""
+import os
+import json
+import time
+import shutil
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from .. import data_file_dir, logger
+from . import models
+from . import metrics
+from .functions import iter_frames
+
+panel_dir = os.path.join(data_file_dir, 'panels')
+
+class Panel:
+    """Memory-mapped date x asset matrix with its axes."""
+    def __init__(self, values: np.ndarray, dates: np.ndarray,
+                 asset_ids: np.ndarray, meta: dict):
+        self.values = values
+        self.dates = dates
+        self.asset_ids = asset_ids
+        self.meta = meta
+
+    def frame(self) -> pd.DataFrame:
+        """The panel as a dataframe over the mapped array, without copying."""
+        return pd.DataFrame(self.values,
+                            index=pd.DatetimeIndex(self.dates, name='date'),
+                            columns=pd.Index(self.asset_ids, name='asset_id'),
+                            copy=False)
+
+    def column(self, asset_id) -> np.ndarray:
+        """One asset's series (a strided view)."""
+        position = np.searchsorted(self.asset_ids, asset_id)
+        if position == len(self.asset_ids) or self.asset_ids[position] != asset_id:
+            raise KeyError(asset_id)
+        return self.values[:, position]
+
+    def __repr__(self):
+        return (f"Panel({self.meta['table']}.{self.meta['value_col']}, "
+                f"{len(self.dates)} dates x {len(self.asset_ids)} assets)")
+
+def _path(name: str, filename: str, meta: dict = None) -> str:
+    """Path of a panel file; data files live in `meta`'s version directory."""
+    if meta is None or 'version' not in meta:
+        return os.path.join(panel_dir, name, filename)
+    return os.path.join(panel_dir, name, meta['version'], filename)
+
+def _prune(name: str, keep: list):
+    """Remove version directories of `name` other than `keep`."""
+    directory = os.path.join(panel_dir, name)
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        if os.path.isdir(path) and entry not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+def _replace(path: str, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as fh:
+        write(fh)
+    os.replace(tmp_path, path)
+
+def _write_meta(name: str, meta: dict):
+    _replace(_path(name, 'meta.json'),
+             lambda fh: fh.write(json.dumps(meta, indent=2).encode()))
+
+def _read_meta(name: str) -> dict:
+    with open(_path(name, 'meta.json')) as fh:
+        return json.load(fh)
+
+def _criterion(db_table, tidemark_id=None, asset_ids=None, after=None):
+    criterion = []
+    if tidemark_id is not None:
+        criterion.append(db_table.tidemark_id == int(tidemark_id))
+    if asset_ids is not None:
+        criterion.append(db_table.asset_id.in_([int(i) for i in asset_ids]))
+    if after is not None:
+        criterion.append(db_table.date > after)
+    return criterion
+
+def _distinct(db_table, col: str, criterion: list) -> np.ndarray:
+    column = getattr(db_table, col)
+    statement = select(column).distinct().order_by(column)
+    for criteria in criterion:
+        statement = statement.where(criteria)
+    return np.array([v for v, in models.session.execute(statement)])
+
+def _fill(values: np.ndarray, dates: np.ndarray, asset_ids: np.ndarray,
+          db_table, value_col: str, criterion: list, chunksize: int = 100000):
+    """Scatter the rows matching `criterion` into `values` by position."""
+    skipped = 0
+    for chunk in iter_frames(db_table, criterion, chunksize=chunksize):
+        chunk_dates = chunk.index.get_level_values('date').values \
+                           .astype('datetime64[D]')
+        chunk_assets = chunk.index.get_level_values('asset_id').values
+        rows = np.searchsorted(dates, chunk_dates)
+        cols = np.searchsorted(asset_ids, chunk_assets)
+        found = (rows < len(dates)) & (cols < len(asset_ids))
+        found[found] &= (dates[rows[found]] == chunk_dates[found]) \
+                        & (asset_ids[cols[found]] == chunk_assets[found])
+        skipped += int((~found).sum())
+        data = chunk[value_col].to_numpy(dtype=values.dtype, na_value=np.nan)
+        values[rows[found], cols[found]] = data[found]
+    return skipped
+
+def _map(name: str, meta: dict, mode: str = 'r') -> np.ndarray:
+    shape = (meta['dates'], meta['assets'])
+    if not shape[0] or not shape[1]:
+        return np.empty(shape, dtype=meta['dtype'])
+    return np.memmap(_path(name, 'values.bin', meta), dtype=meta['dtype'],
+                     mode=mode, shape=shape)
+
+@metrics.timed
+def build(name: str, db_table=None, value_col: str = 'price',
+          tidemark_id: int = None, asset_ids=None,
+          dtype: str = 'float32') -> Panel:
+    """Build the panel `name` from `db_table.value_col`.
+
+    Parameters
+    ==========
+    db_table: sqlalchemy.ext.declarative.api.DeclarativeMeta
+        History model with `asset_id` and `date`; `PriceHistory` by default.
+    tidemark_id: int
+        Tidemark to take from `TidemarkDaily`/`TidemarkHistory`.
+    asset_ids: list
+        Columns of the panel; every asset with rows by default.
+    dtype: str
+        'float32' or 'float64'. Missing values are NaN.
+
+    An existing panel of the same name is replaced; processes that already
+    mapped it keep reading the old files, and the version before it is kept
+    until the next build.
+    """
+    db_table = models.PriceHistory if db_table is None else db_table
+    criterion = _criterion(db_table, tidemark_id, asset_ids)
+    dates = _distinct(db_table, 'date', criterion).astype('datetime64[D]')
+    asset_filter = None if asset_ids is None else sorted(int(i) for i in asset_ids)
+    if asset_ids is None:
+        asset_ids = _distinct(db_table, 'asset_id', criterion)
+    asset_ids = np.unique(np.asarray(asset_ids, dtype='int64'))
+
+    try:
+        previous = _read_meta(name).get('version')
+    except FileNotFoundError:
+        previous = None
+    meta = {'table': db_table.__table__.name, 'value_col': value_col,
+            'tidemark_id': tidemark_id, 'dtype': dtype,
+            'dates': len(dates), 'assets': len(asset_ids),
+            'asset_filter': asset_filter,
+            'version': f"{time.time_ns()}-{os.getpid()}"}
+    os.makedirs(_path(name, '', meta))
+    values_path = _path(name, 'values.bin', meta)
+    if len(dates) and len(asset_ids):
+        values = np.memmap(values_path, dtype=dtype, mode='w+',
+                           shape=(len(dates), len(asset_ids)))
+        values[:] = np.nan
+        _fill(values, dates, asset_ids, db_table, value_col, criterion)
+        values.flush()
+        del values
+    else:
+        open(values_path, 'wb').close()
+    np.save(_path(name, 'dates.npy', meta), dates)
+    np.save(_path(name, 'asset_ids.npy', meta), asset_ids)
+    # The new version becomes visible with its meta.json, written last.
+    _write_meta(name, meta)
+    _prune(name, keep=[meta['version'], previous])
+    return load(name)
+
+@metrics.timed
+def update(name: str) -> Panel:
+    """Append the dates after the panel's last date as new rows.
+
+    Only new dates are read. Assets that were not in the panel when it was
+    built are skipped (and counted in the log); `build` again to add them.
+    """
+    meta = _read_meta(name)
+    db_table = getattr(models.Base.classes, meta['table'])
+    dates = np.load(_path(name, 'dates.npy', meta))[:meta['dates']]
+    asset_ids = np.load(_path(name, 'asset_ids.npy', meta))
+    last = pd.Timestamp(dates[-1]).date() if len(dates) else None
+    criterion = _criterion(db_table, meta['tidemark_id'], meta['asset_filter'],
+                           after=last)
+    new_dates = _distinct(db_table, 'date', criterion).astype('datetime64[D]')
+    if not len(new_dates) or not len(asset_ids):
+        return load(name)
+
+    shape = (len(new_dates), len(asset_ids))
+    values_path = _path(name, 'values.bin', meta)
+    with open(values_path, 'r+b') as fh:
+        # Drop any rows a failed update left past the committed shape.
+        fh.truncate(meta['dates'] * len(asset_ids) * np.dtype(meta['dtype']).itemsize)
+        fh.seek(0, os.SEEK_END)
+        fh.write(np.full(shape, np.nan, dtype=meta['dtype']).tobytes())
+    values = np.memmap(values_path, dtype=meta['dtype'], mode='r+',
+                       offset=meta['dates'] * len(asset_ids)
+                              * np.dtype(meta['dtype']).itemsize,
+                       shape=shape)
+    skipped = _fill(values, new_dates, asset_ids, db_table, meta['value_col'],
+                    criterion)
+    values.flush()
+    del values
+    if skipped:
+        logger.warning(f"Panel {name}: {skipped} rows of assets outside the "
+                       f"panel were skipped; rebuild it to add them.")
+
+    all_dates = np.concatenate([dates, new_dates])
+    _replace(_path(name, 'dates.npy', meta), lambda fh: np.save(fh, all_dates))
+    meta['dates'] = len(all_dates)
+    _write_meta(name, meta)
+    return load(name)
+
+def load(name: str) -> Panel:
+    """Map panel `name` read-only; shared between processes by the OS."""
+    meta = _read_meta(name)
+    dates = np.load(_path(name, 'dates.npy', meta))[:meta['dates']]
+    asset_ids = np.load(_path(name, 'asset_ids.npy', meta))
+    return Panel(_map(name, meta), dates, asset_ids, meta)
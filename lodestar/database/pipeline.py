@@ -0,0 +1,291 @@
+"""Staged price ingestion: fetch -> normalize -> load.
+
+Each stage runs its own pool of worker threads and the stages are connected
+by bounded queues, so network fetches, dataframe normalization and database
+writes overlap while a slow stage holds the earlier ones back instead of
+letting frames pile up in memory. The load stage coalesces the small
+per-asset frames into batches of about `batch_rows` rows and writes each
+batch to `price_history` with one `loader.copy_upsert`.
+
+Fetchers are plain callables `fetcher(asset_id, ticker)->pandas.DataFrame`
+returning raw prices indexed by date. `YahooFetcher` downloads them with
+`yfinance`; `FileFetcher` reads them from local CSV files, for tests and
+replays.
+
+Methods
+-------
+Pipeline(fetcher).run(assets)->pandas.DataFrame
+    Ingest `{asset_id: ticker}` and return per-stage statistics.
+
+YahooFetcher(period='max'), FileFetcher(directory)
+    Fetchers.
+"""
+import os
+import time
+import queue
+import threading
+import pandas as pd
+import yfinance
+from .. import logger
+from . import models
+from . import loader
+from . import maps
+
+_done = object()
+
+class YahooFetcher:
+    """Daily prices from Yahoo Finance."""
+    def __init__(self, period: str = 'max', start=None, column: str = 'Close'):
+        self.period = period
+        self.start = start
+        self.column = column
+
+    def __call__(self, asset_id, ticker: str) -> pd.DataFrame:
+        if self.start is not None:
+            history = yfinance.Ticker(ticker).history(start=self.start)
+        else:
+            history = yfinance.Ticker(ticker).history(period=self.period)
+        return history[[self.column]]
+
+class FileFetcher:
+    """Prices from `<directory>/<ticker>.csv` files with a date column."""
+    def __init__(self, directory: str, pattern: str = '{ticker}.csv',
+                 date_col: str = 'date', column: str = 'price'):
+        self.directory = directory
+        self.pattern = pattern
+        self.date_col = date_col
+        self.column = column
+
+    def __call__(self, asset_id, ticker: str) -> pd.DataFrame:
+        path = os.path.join(self.directory,
+                            self.pattern.format(ticker=ticker, asset_id=asset_id))
+        return pd.read_csv(path, index_col=self.date_col, parse_dates=True,
+                           usecols=[self.date_col, self.column])
+
+class StageStats:
+    """Thread-safe counters of one stage."""
+    def __init__(self, name: str, workers: int, input_queue: queue.Queue):
+        self.name = name
+        self.workers = workers
+        self.input_queue = input_queue
+        self.items = 0
+        self.rows = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.max_depth = 0
+        self.depth_total = 0
+        self.depth_samples = 0
+        self._lock = threading.Lock()
+
+    def sample(self):
+        depth = self.input_queue.qsize()
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+            self.depth_total += depth
+            self.depth_samples += 1
+
+    def record(self, seconds: float, items: int = 1, rows: int = 0,
+               error: bool = False):
+        with self._lock:
+            self.items += items
+            self.rows += rows
+            self.errors += int(error)
+            self.busy_seconds += seconds
+
+    def row(self, wall_seconds: float) -> dict:
+        return {'stage': self.name, 'workers': self.workers,
+                'items': self.items, 'rows': self.rows, 'errors': self.errors,
+                'busy_seconds': self.busy_seconds,
+                'items_per_second': self.items / wall_seconds if wall_seconds else 0,
+                'rows_per_second': self.rows / wall_seconds if wall_seconds else 0,
+                'max_queue_depth': self.max_depth,
+                'mean_queue_depth': self.depth_total / self.depth_samples
+                                    if self.depth_samples else 0}
+
+class Pipeline:
+    """Fetch, normalize and load prices with bounded queues between stages.
+
+    Parameters
+    ==========
+    fetcher: callable
+        `fetcher(asset_id, ticker)->pandas.DataFrame` of prices by date.
+    db_table: sqlalchemy.ext.declarative.api.DeclarativeMeta
+        Target model; `PriceHistory` by default.
+    fetch_workers, normalize_workers, load_workers: int
+        Concurrent workers per stage.
+    queue_size: int
+        Capacity of each queue between stages.
+    batch_rows: int
+        Rows coalesced into one `copy_upsert`.
+    flush_seconds: float
+        Write a partial batch when no frame arrived for this long.
+    """
+    def __init__(self, fetcher, db_table=None, fetch_workers: int = 8,
+                 normalize_workers: int = 2, load_workers: int = 2,
+                 queue_size: int = 64, batch_rows: int = 200000,
+                 flush_seconds: float = 5.0, price_col: str = 'price',
+                 insert_only: bool = False):
+        self.fetcher = fetcher
+        self.db_table = db_table
+        self.workers = {'fetch': fetch_workers, 'normalize': normalize_workers,
+                        'load': load_workers}
+        self.queue_size = queue_size
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.price_col = price_col
+        self.insert_only = insert_only
+        self.failed = []
+
+    ## STAGES
+    def fetch(self, item):
+        asset_id, ticker = item
+        return asset_id, self.fetcher(asset_id, ticker)
+
+    def normalize(self, item) -> pd.DataFrame:
+        """Raw fetcher output to `price_col` indexed by `(asset_id, date)`."""
+        asset_id, raw = item
+        prices = raw.iloc[:, 0].rename(self.price_col).dropna()
+        dates = pd.to_datetime(prices.index)
+        if getattr(dates, 'tz', None) is not None:
+            dates = dates.tz_localize(None)
+        frame = prices.to_frame()
+        frame.index = pd.MultiIndex.from_arrays(
+            [[int(asset_id)] * len(frame), dates.normalize()],
+            names=['asset_id', 'date'])
+        return frame[~frame.index.duplicated(keep='last')]
+
+    def load(self, frames: list) -> int:
+        batch = pd.concat(frames)
+        inserted, updated = loader.copy_upsert(batch, self.db_table,
+                                               insert_only=self.insert_only)
+        return inserted + updated
+
+    ## WORKERS
+    def _finish(self, stage: str, output: queue.Queue):
+        """Let the last worker of a stage shut the next stage down."""
+        with self._lock:
+            self._running[stage] -= 1
+            last = not self._running[stage]
+        if last and output is not None:
+            for _ in range(self.workers[self._next[stage]]):
+                output.put(_done)
+
+    def _worker(self, stage: str, function, source: queue.Queue,
+                output: queue.Queue):
+        stats = self.stats[stage]
+        while True:
+            stats.sample()
+            item = source.get()
+            if item is _done:
+                break
+            start = time.perf_counter()
+            try:
+                result = function(item)
+            except Exception as e:
+                stats.record(time.perf_counter() - start, error=True)
+                self.failed.append((stage, item[0], repr(e)))
+                logger.warning(f"Pipeline {stage} failed for asset {item[0]}: {e!r}")
+                continue
+            rows = len(result) if stage == 'normalize' else \
+                   len(result[1]) if stage == 'fetch' else 0
+            stats.record(time.perf_counter() - start, rows=rows)
+            output.put(result)
+        self._finish(stage, output)
+
+    def _flush(self, frames: list):
+        stats = self.stats['load']
+        start = time.perf_counter()
+        try:
+            written = self.load(frames)
+        except Exception as e:
+            stats.record(time.perf_counter() - start, items=len(frames), error=True)
+            asset_ids = [f.index.get_level_values('asset_id')[0] for f in frames
+                         if len(f)]
+            self.failed.extend(('load', a, repr(e)) for a in asset_ids)
+            logger.error(f"Pipeline load of {len(frames)} frames failed: {e!r}")
+            return
+        stats.record(time.perf_counter() - start, items=len(frames),
+                     rows=sum(len(f) for f in frames))
+        logger.info(f"Pipeline loaded {len(frames)} assets, {written} rows written.")
+
+    def _loader(self, source: queue.Queue):
+        stats = self.stats['load']
+        frames, rows = [], 0
+        while True:
+            stats.sample()
+            try:
+                item = source.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                if frames:
+                    self._flush(frames)
+                    frames, rows = [], 0
+                continue
+            if item is _done:
+                break
+            frames.append(item)
+            rows += len(item)
+            if rows >= self.batch_rows:
+                self._flush(frames)
+                frames, rows = [], 0
+        if frames:
+            self._flush(frames)
+        self._finish('load', None)
+
+    ## RUN
+    def run(self, assets=None) -> pd.DataFrame:
+        """Ingest `assets` and return per-stage statistics.
+
+        Parameters
+        ==========
+        assets: dict
+            `{asset_id: ticker}`; every asset in `maps.asset_map` by default.
+
+        Returns
+        =======
+        pandas.DataFrame
+            One row per stage with items, rows, errors, busy time, throughput
+            and the maximum and mean depth of its input queue. Assets that
+            failed are listed in `self.failed`.
+        """
+        if self.db_table is None:
+            self.db_table = models.PriceHistory
+        assets = dict(maps.asset_map) if assets is None else dict(assets)
+        queues = {stage: queue.Queue(maxsize=self.queue_size)
+                  for stage in self.workers}
+        self._next = {'fetch': 'normalize', 'normalize': 'load'}
+        self._running = dict(self.workers)
+        self._lock = threading.Lock()
+        self.failed = []
+        self.stats = {stage: StageStats(stage, self.workers[stage], queues[stage])
+                      for stage in self.workers}
+
+        threads = []
+        for stage, function in [('fetch', self.fetch),
+                                ('normalize', self.normalize)]:
+            output = queues[self._next[stage]]
+            threads += [threading.Thread(target=self._worker,
+                                         args=(stage, function, queues[stage],
+                                               output),
+                                         name=f"lodestar-{stage}-{i}",
+                                         daemon=True)
+                        for i in range(self.workers[stage])]
+        threads += [threading.Thread(target=self._loader, args=(queues['load'],),
+                                     name=f"lodestar-load-{i}", daemon=True)
+                    for i in range(self.workers['load'])]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for item in assets.items():
+            queues['fetch'].put(item)
+        for _ in range(self.workers['fetch']):
+            queues['fetch'].put(_done)
+        for thread in threads:
+            thread.join()
+        wall_seconds = time.perf_counter() - start
+
+        report = pd.DataFrame([s.row(wall_seconds) for s in self.stats.values()])\
+                   .set_index('stage')
+        logger.info(f"Pipeline finished {len(assets)} assets in "
+                    f"{wall_seconds:.1f}s:\n{report.to_string()}")
+        return report
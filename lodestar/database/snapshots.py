@@ -0,0 +1,92 @@
+"""Bulk point-in-time snapshots of the history tables.
+
+`Asset.current_price` lazy-loads one query per asset. `latest_prices` returns
+the latest `price_history` row for every asset (or a subset) with a single
+`DISTINCT ON (asset_id)` query, optionally cached in-process for a short
+TTL. Both sort keys are descending so that a backward scan of the
+`(asset_id, date)` unique index returns the rows already in order; with
+`asset_id` ascending and `date` descending the planner adds an Incremental
+Sort. Cached snapshots are dropped when `cache.invalidate('price_history')`
+bumps the table's generation.
+
+Methods
+-------
+latest_prices(asset_ids=None, as_of=None, ttl=None)->pandas.DataFrame
+    Latest price row per asset, indexed by asset id.
+
+clear_cache()
+    Drop cached snapshots.
+"""
+import time
+import threading
+import pandas as pd
+from sqlalchemy import select
+from . import models
+from . import metrics
+from . import cache
+from .functions import rows_to_dataframe
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def latest_statement(db_table, asset_ids=None, as_of=None):
+    """`SELECT DISTINCT ON (asset_id) ... ORDER BY asset_id DESC, date DESC`."""
+    table = db_table.__table__
+    statement = select(table).distinct(table.c.asset_id) \
+                             .order_by(table.c.asset_id.desc(),
+                                       table.c.date.desc())
+    if asset_ids is not None:
+        statement = statement.where(table.c.asset_id.in_(list(asset_ids)))
+    if as_of is not None:
+        statement = statement.where(table.c.date <= as_of)
+    return statement
+
+@metrics.timed
+def latest_prices(asset_ids=None, as_of=None, ttl: float = None,
+                  drop_last_modified=True) -> pd.DataFrame:
+    """Latest `price_history` row for each asset in one round-trip.
+
+    Parameters
+    ==========
+    asset_ids: list
+        Restrict to these assets; all assets by default.
+    as_of: datetime.date
+        Latest row on or before this date instead of the latest overall.
+    ttl: float
+        Serve a cached snapshot up to `ttl` seconds old for the same
+        arguments, unless `price_history` was written through this package
+        since (see `cache.invalidate`).
+
+    Returns
+    =======
+    pandas.DataFrame
+        One row per asset, indexed by `asset_id`, with the price row's `date`
+        and value columns.
+    """
+    key = (None if asset_ids is None else tuple(sorted(set(asset_ids))),
+           as_of, drop_last_modified)
+    db_table = models.PriceHistory
+    generation = cache.query_cache.generation(db_table.__table__.name)
+    if ttl:
+        with _cache_lock:
+            cached = _cache.get(key)
+        if cached and cached[1] == generation \
+                  and time.monotonic() - cached[0] < ttl:
+            return cached[2].copy()
+
+    result = models.session.execute(latest_statement(db_table, key[0], as_of))
+    snapshot = rows_to_dataframe(result.fetchall(), list(result.keys()),
+                                 db_table, drop_last_modified=drop_last_modified)
+    if 'date' in snapshot.index.names:
+        snapshot = snapshot.reset_index(level='date')
+    snapshot = snapshot.sort_index()
+
+    if ttl:
+        with _cache_lock:
+            _cache[key] = (time.monotonic(), generation, snapshot)
+        return snapshot.copy()
+    return snapshot
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -38,5 +38,9 @@ setuptools.setup(
         'xlrd>=1.2.0',
         'yfinance>=0.1.54'
     ],
+    extras_require={
+        'mirror': ['pyarrow>=3.0.0'],
+        'async': ['asyncpg>=0.22.0'],
+    },
     python_requires='>=3.8.0'
 )